@@ -1,76 +1,380 @@
-from telegram import Bot
+from telegram import Bot, InputMediaDocument
+from telegram.error import BadRequest, Forbidden, RetryAfter
 from telegram.ext import ApplicationBuilder
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 import asyncio
+import hashlib
+import io
 import os
+import random
+import sqlite3
+import time
+from collections import deque
 from PIL import Image
 
+import metrics
+from fingerprints import EXIF_IMAGE_DESCRIPTION, FINGERPRINT_PREFIX
+
 BOT_TOKEN = '7522224142:AAHKUUZFcW-PD3uob9LJcFkCVguhI30feaQ'
 CHANNEL_ID = '@programm_123'
 OUTPUT_DIR = '../Task_12/'
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp')
+BOT_API_BASE_URL = 'https://api.telegram.org/bot'  # Point at a local fake Bot API server to test without Telegram
+UPLOAD_CONCURRENCY = 2  # Uploads in flight at once; also the size of the HTTP connection pool
+UPLOAD_RETRIES = 3
+BACKOFF_BASE = 1.0  # Seconds before the first retry; doubled on every further retry
+BACKOFF_MAX = 30.0
+BATCH_WINDOW = 3.0  # Seconds to wait for the other images of a cycle before posting what has arrived
+MEDIA_GROUP_SIZE = 10  # Telegram accepts 2 to 10 files per media group
+STATS_INTERVAL = 60  # Seconds between upload statistics printouts
+UPLOAD_JOURNAL = 'upload_journal.sqlite3'  # Content hashes of everything already posted, kept across restarts
+METRICS_PORT = 9110  # Prometheus text endpoint for the upload metrics (see metrics.py); None turns it off
+METRICS_JSONL = 'metrics_post.jsonl'  # JSONL snapshots of the same metrics, rotated by size; None turns them off
 
-class ImageHandler(FileSystemEventHandler):
-    def __init__(self, bot, loop):
+
+def image_fingerprint(data):
+    """The workbook fingerprint the renderer stored in the image metadata, or None."""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            text = image.info.get('Comment') or image.info.get('comment') or image.getexif().get(EXIF_IMAGE_DESCRIPTION)
+    except Exception:
+        return None
+    if isinstance(text, bytes):
+        text = text.decode('utf-8', 'replace')
+    if text and text.startswith(FINGERPRINT_PREFIX):
+        return text[len(FINGERPRINT_PREFIX):]
+    return None
+
+
+def read_image(image_path):
+    """
+    The file's bytes, their SHA-256 (which identifies the content whatever the file is called) and the workbook
+    fingerprint from the image metadata.
+    """
+    with open(image_path, 'rb') as image:
+        return describe_image(image.read())
+
+
+def describe_image(data):
+    """(data, SHA-256, workbook fingerprint) for image bytes that were handed over in memory."""
+    return data, hashlib.sha256(data).hexdigest(), image_fingerprint(data)
+
+
+class UploadJournal:
+    """
+    Append-only record of posted images keyed by content hash, in SQLite. The hashes are also kept in a set, so
+    checking whether content was already posted never touches the disk.
+
+    Content is reserved before it is sent: a row without posted_at, inserted only if the hash is not there yet.
+    Two uploads of the same content therefore cannot both get past the check while the first is still sending.
+    The reservation becomes the record once the post succeeds and is deleted if it fails.
+    """
+
+    def __init__(self, path=UPLOAD_JOURNAL):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS uploads (content_hash TEXT PRIMARY KEY, image_path TEXT, posted_at REAL)")
+        # Reservations left by a poster that stopped mid-upload; that content may never have reached the channel
+        self.connection.execute("DELETE FROM uploads WHERE posted_at IS NULL")
+        self.connection.commit()
+        self.hashes = {row[0] for row in self.connection.execute("SELECT content_hash FROM uploads")}
+        self.reserved = set()  # Hashes being posted right now
+        print(f"Upload journal {path}: {len(self.hashes)} images already posted.")
+
+    def __contains__(self, content_hash):
+        return content_hash in self.hashes or content_hash in self.reserved
+
+    def reserve(self, content_hash, image_path):
+        """Claim content for posting; False if it was already posted or is being posted."""
+        if content_hash in self:
+            return False
+        cursor = self.connection.execute("INSERT OR IGNORE INTO uploads VALUES (?, ?, NULL)", (content_hash, image_path))
+        self.connection.commit()
+        if cursor.rowcount == 0:
+            return False
+        self.reserved.add(content_hash)
+        return True
+
+    def release(self, content_hash):
+        """Drop the reservation of content that could not be posted, so a later copy is tried again."""
+        if content_hash not in self.reserved:
+            return
+        self.connection.execute("DELETE FROM uploads WHERE content_hash = ? AND posted_at IS NULL", (content_hash,))
+        self.connection.commit()
+        self.reserved.discard(content_hash)
+
+    def record(self, content_hash, image_path):
+        if content_hash in self.hashes:
+            return
+        self.connection.execute("INSERT OR REPLACE INTO uploads VALUES (?, ?, ?)", (content_hash, image_path, time.time()))
+        self.connection.commit()
+        self.hashes.add(content_hash)
+        self.reserved.discard(content_hash)
+
+    def close(self):
+        self.connection.close()
+
+
+def retry_after_seconds(error):
+    # Depending on the library version retry_after is a number of seconds or a timedelta
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+
+
+class UploadQueue:
+    """
+    Uploads images to the channel with at most `concurrency` requests in flight. Images queued within BATCH_WINDOW
+    of each other (one cycle's instruments) go out as a single media group. Flood-wait (RetryAfter) errors are
+    waited out for the time Telegram asks for, other failures are retried with exponential backoff and jitter.
+
+    Images are queued as a file path, or as a name plus the encoded bytes when the renderer runs in the same process.
+    With a maxsize, submit() waits for room, so a producer is held back while uploads lag.
+    """
+
+    def __init__(self, bot, journal, concurrency=UPLOAD_CONCURRENCY, batch_window=BATCH_WINDOW, maxsize=0):
         self.bot = bot
-        self.loop = loop
-        self.processed_files = set()  # Track processed files
+        self.journal = journal
+        self.concurrency = concurrency
+        self.batch_window = batch_window
+        self.queue = asyncio.Queue(maxsize)
+        self.collect_lock = asyncio.Lock()  # One worker at a time gathers a batch
+        self.workers = []
+        self.in_flight = 0
+        self.latencies = deque(maxlen=1000)  # Seconds from queueing to a finished upload
+        self.uploaded = 0
+        self.failed = 0
+        self.skipped = 0  # Content that was already posted, under this or another name
+        self.fingerprints = {}  # Image name -> fingerprint of the last tables posted under it
+        self.unchanged = 0  # Images skipped because their tables matched the last ones posted
+        self.requests = 0  # Bot API calls made, retries included
 
-    def on_created(self, event):
-        if not event.is_directory and event.src_path.lower().endswith(('.png', '.jpg', '.jpeg', '.gif')):
-            # Check if the file has already been processed
-            if event.src_path not in self.processed_files:
-                # Schedule the coroutine in the main event loop
-                self.loop.call_soon_threadsafe(asyncio.create_task, self.post_image_to_telegram(event.src_path))
+    def start(self):
+        self.workers = [asyncio.create_task(self.worker()) for _ in range(self.concurrency)]
 
-    async def post_image_to_telegram(self, image_path, retries=3):
-        try:
-            await asyncio.sleep(1)  # Wait a bit to ensure the file is fully written
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
 
-            if not os.path.exists(image_path) or not os.path.isfile(image_path):
+    async def drain(self):
+        """Wait until everything queued has been posted (or has failed), then stop the workers."""
+        await self.queue.join()
+        await self.stop()
+
+    def put(self, image_path, data=None):
+        self.queue.put_nowait((image_path, data, time.monotonic()))
+
+    async def submit(self, image_path, data=None):
+        await self.queue.put((image_path, data, time.monotonic()))
+
+    async def collect_batch(self):
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < MEDIA_GROUP_SIZE:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def worker(self):
+        while True:
+            async with self.collect_lock:
+                batch = await self.collect_batch()
+            self.in_flight += len(batch)
+            try:
+                results = await self.post_images([(image_path, data) for image_path, data, _ in batch])
+                for (image_path, _, queued_at), result in zip(batch, results):
+                    metrics.count(f"post.{result}")
+                    if result == 'posted':
+                        self.uploaded += 1
+                        self.latencies.append(time.monotonic() - queued_at)
+                        metrics.observe('post.latency', self.latencies[-1])
+                    elif result == 'skipped':
+                        self.skipped += 1
+                    elif result == 'unchanged':
+                        self.unchanged += 1
+                    else:
+                        self.failed += 1
+            finally:
+                self.in_flight -= len(batch)
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def send_with_retries(self, description, send, retries=UPLOAD_RETRIES):
+        for attempt in range(retries + 1):
+            try:
+                self.requests += 1
+                metrics.count('post.requests')
+                with metrics.timer('post.upload'):
+                    await send()
+                print(f"Posted {description} to Telegram as document.")
+                return True
+
+            except RetryAfter as e:
+                metrics.count('post.rate_limited')
+                delay = retry_after_seconds(e)
+            except (BadRequest, Forbidden) as e:
+                print(f"Failed to post {description} to Telegram: {e}")
+                return False
+            except Exception as e:
+                if attempt == retries:
+                    print(f"Failed to post {description} to Telegram: {e}")
+                    return False
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.5)
+
+            if attempt < retries:
+                print(f"Failed to post {description}. Retrying in {delay:.1f} seconds... ({retries - attempt} attempts left)")
+                await asyncio.sleep(delay)
+        print(f"Failed to post {description} to Telegram: still rate limited")
+        return False
+
+    async def read_images(self, items):
+        """(bytes, content hash, fingerprint) of each item, None for paths that are gone. Files are read in the default executor."""
+        loop = asyncio.get_running_loop()
+        images = []
+        for image_path, data in items:
+            if data is not None:
+                images.append(await loop.run_in_executor(None, describe_image, data))
+                continue
+            if not os.path.isfile(image_path):
                 print(f"File {image_path} does not exist or is not a file.")
-                return
+                images.append(None)
+                continue
+            # The renderer already encoded the image in its final format and size; post it as is
+            images.append(await loop.run_in_executor(None, read_image, image_path))
+        return images
+
+    async def post_images(self, items):
+        """
+        Post a batch of (image_path, data) items as one media group, falling back to one message per image; data is
+        None when the image is to be read from image_path. Content the journal has posted, or is posting in another
+        batch or earlier in this one, is skipped, and so is an image whose workbook fingerprint matches the last one
+        posted under its name. Returns 'posted', 'skipped', 'unchanged' or 'failed' per item.
+        """
+        image_paths = [image_path for image_path, _ in items]
+        images = await self.read_images(items)
+        results = ['failed' if image is None else None for image in images]
+        pending = []  # (index, image_path, data, content_hash) still to post
+        fingerprints = {}  # image_path -> fingerprint to remember once posted
+        for index, (image_path, image) in enumerate(zip(image_paths, images)):
+            if image is None:
+                continue
+            data, content_hash, fingerprint = image
+            name = os.path.splitext(os.path.basename(image_path))[0]
+            if fingerprint is not None and self.fingerprints.get(name) == fingerprint:
+                print(f"{image_path} shows the same tables as the last post. Skipping.")
+                results[index] = 'unchanged'
+                continue
+            if not self.journal.reserve(content_hash, image_path):
+                print(f"{image_path} was already posted. Skipping.")
+                results[index] = 'skipped'
+                continue
+            pending.append((index, image_path, data, content_hash))
+            fingerprints[image_path] = fingerprint
+
+        try:
+            if len(pending) > 1:
+                media = [InputMediaDocument(data, filename=os.path.basename(image_path))
+                         for _, image_path, data, _ in pending]
+                description = ', '.join(image_path for _, image_path, _, _ in pending)
+                if await self.send_with_retries(description,
+                                                lambda: self.bot.send_media_group(chat_id=CHANNEL_ID, media=media)):
+                    for index, image_path, _, content_hash in pending:
+                        self.record_posted(image_path, content_hash, fingerprints[image_path])
+                        results[index] = 'posted'
+                    return results
+                print("Media group failed; posting the images one by one.")
+
+            for index, image_path, data, content_hash in pending:
+                if await self.post_image_to_telegram(image_path, data):
+                    self.record_posted(image_path, content_hash, fingerprints[image_path])
+                    results[index] = 'posted'
+                else:
+                    results[index] = 'failed'
+            return results
+        finally:
+            # Failed, or cancelled mid-upload: free the content for the next copy that comes along
+            for index, _, _, content_hash in pending:
+                if results[index] != 'posted':
+                    self.journal.release(content_hash)
 
-            # Optimize the image if desired
-            optimize_image(image_path)
+    def record_posted(self, image_path, content_hash, fingerprint):
+        self.journal.record(content_hash, image_path)
+        if fingerprint is not None:
+            self.fingerprints[os.path.splitext(os.path.basename(image_path))[0]] = fingerprint
 
-            with open(image_path, 'rb') as image:
-                await self.bot.send_document(chat_id=CHANNEL_ID, document=image)
-                print(f"Posted {image_path} to Telegram as document.")
+    async def post_image_to_telegram(self, image_path, image):
+        return await self.send_with_retries(
+            image_path,
+            lambda: self.bot.send_document(chat_id=CHANNEL_ID, document=image, filename=os.path.basename(image_path)))
 
-        except Exception as e:
-            if retries > 0:
-                print(f"Failed to post {image_path}. Retrying... ({retries} attempts left)")
-                await asyncio.sleep(2)  # Wait a bit before retrying
-                await self.post_image_to_telegram(image_path, retries - 1)
-            else:
-                print(f"Failed to post {image_path} to Telegram: {e}")
+    def stats(self):
+        latencies = sorted(self.latencies)
 
-def optimize_image(image_path):
-    with Image.open(image_path) as img:
-        img = img.convert('RGB')
-        img.save(image_path, 'JPEG', quality=95)  # Adjust quality as needed
+        def percentile(q):
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else 0.0
 
-async def send_existing_images(bot, loop, processed_files):
+        return {'queue_depth': self.queue.qsize(), 'in_flight': self.in_flight, 'uploaded': self.uploaded,
+                'failed': self.failed, 'skipped': self.skipped, 'unchanged': self.unchanged, 'requests': self.requests,
+                'latency_p50': percentile(0.5), 'latency_p95': percentile(0.95)}
+
+    def summarize(self):
+        stats = self.stats()
+        print(f"Uploads: {stats['uploaded']} done, {stats['failed']} failed, {stats['skipped']} duplicates and "
+              f"{stats['unchanged']} unchanged tables skipped "
+              f"in {stats['requests']} requests, {stats['queue_depth']} queued, {stats['in_flight']} in flight; "
+              f"latency p50 {stats['latency_p50']:.2f}s, p95 {stats['latency_p95']:.2f}s")
+
+
+class ImageHandler(FileSystemEventHandler):
+    def __init__(self, uploads, loop):
+        self.uploads = uploads
+        self.loop = loop
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.schedule_post(event.src_path)
+
+    def on_moved(self, event):
+        # The renderer writes to a temporary file and renames it into place
+        if not event.is_directory:
+            self.schedule_post(event.dest_path)
+
+    def schedule_post(self, image_path):
+        if image_path.lower().endswith(IMAGE_EXTENSIONS):
+            # Hand the file to the upload queue on the main event loop; it skips content that was already posted
+            self.loop.call_soon_threadsafe(self.uploads.put, image_path)
+
+
+async def send_existing_images(uploads):
+    # Images posted before a restart are in the upload journal and are skipped by content hash
     for filename in os.listdir(OUTPUT_DIR):
-        if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.gif')):
+        if filename.lower().endswith(IMAGE_EXTENSIONS):
             image_path = os.path.join(OUTPUT_DIR, filename)
             if os.path.isfile(image_path):
-                # Check if the file has already been processed
-                if image_path not in processed_files:
-                    # Schedule the task to post existing images
-                    loop.call_soon_threadsafe(asyncio.create_task, ImageHandler(bot, loop).post_image_to_telegram(image_path))
+                uploads.put(image_path)
 
 async def main():
-    application = ApplicationBuilder().token(BOT_TOKEN).build()
+    # One bot, one HTTP client: its connection pool is shared by all upload workers
+    application = (ApplicationBuilder().token(BOT_TOKEN).base_url(BOT_API_BASE_URL)
+                   .connection_pool_size(UPLOAD_CONCURRENCY).build())
     bot = application.bot
     loop = asyncio.get_running_loop()
 
-    # Initialize ImageHandler with an empty set of processed files
-    handler = ImageHandler(bot, loop)
+    journal = UploadJournal()
+    uploads = UploadQueue(bot, journal)
+    uploads.start()
+    metrics.start_exporters(METRICS_PORT, METRICS_JSONL)
+
+    handler = ImageHandler(uploads, loop)
 
     # Send existing images first
-    await send_existing_images(bot, loop, handler.processed_files)
+    await send_existing_images(uploads)
 
     # Set up monitoring for new images
     observer = Observer()
@@ -81,9 +385,14 @@ async def main():
 
     try:
         while True:
-            await asyncio.sleep(1)
+            await asyncio.sleep(STATS_INTERVAL)
+            uploads.summarize()
+            metrics.summarize()
     except KeyboardInterrupt:
         observer.stop()
+    finally:
+        await uploads.stop()
+        journal.close()
     observer.join()
 
 if __name__ == "__main__":
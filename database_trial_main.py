@@ -1,28 +1,86 @@
 import asyncio
+import base64
 import os
+import sys
 import pandas as pd
 import time
 import json
+import hashlib
+import tempfile
+import threading
+import weakref
+from collections import deque
+from functools import partial
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import StaleElementReferenceException, NoSuchElementException, TimeoutException
-from datetime import datetime, timedelta
+from selenium.common.exceptions import StaleElementReferenceException, NoSuchElementException, TimeoutException, WebDriverException
+from datetime import datetime, timedelta, time as dt_time
 import re
+import metrics
+from fingerprints import FINGERPRINT_PREFIX
+from tick_store import TickStore
 
 
 # Define constants
 INPUT_DIR = '../Task_12/'
 BASE_URL = "https://theautotrender.com"
 PREVIOUS_DATA_FILE = 'previous_data.json'  # File to store previous data
+URLS = [
+    "https://theautotrender.com/derivative?category=niftyW&id=OIData",
+    "https://theautotrender.com/derivative?category=bankNiftyW&id=OIDataW",
+    "https://theautotrender.com/derivative?category=FINNiftyW&id=OIData",
+]
+NUM_WORKERS = 3  # Number of logged-in browsers scraping in parallel
+HEADLESS = True
+TABLE_CHANGE_TIMEOUT = 5  # Max seconds to wait for the interval table to redraw after a tab click
+TABLE_CHANGE_POLL = 0.1
+FIXED_TAB_DELAY = 5  # The old hard sleep after each tab click, kept to report the time saved
+RECORD_TICKS = True  # Keep every scraped snapshot in the tick store (see tick_store.py)
+tick_store = None  # The TickStore main() opens; scrapes hand their snapshots to it
+METRICS_PORT = 9108  # Prometheus text endpoint for the scrape metrics (see metrics.py); None turns it off
+METRICS_JSONL = 'metrics_scrape.jsonl'  # JSONL snapshots of the same metrics, rotated by size; None turns them off
+
+# Candle schedule: instead of sleeping a fixed 60 seconds between cycles, fire each cycle CANDLE_OFFSET seconds
+# after a 3/5/15 minute candle closes (candles counted from MARKET_OPEN) and re-scrape only the intervals that
+# just closed. The renderer only keeps tables whose latest row is the current minute, so drifting off the
+# boundary used to throw whole cycles away.
+USE_CANDLE_SCHEDULE = True
+MARKET_OPEN = dt_time(9, 15)
+CANDLE_MINUTES = {'3 Min': 3, '5 Min': 5, '15 Min': 15}
+CANDLE_OFFSET = 5  # Seconds after the close, giving the site time to publish the new candle
+FIXED_CYCLE_DELAY = 60  # Sleep between cycles when USE_CANDLE_SCHEDULE is off
+
+BTN_3MIN_XPATH = '//*[@id="__next"]/main/div[2]/div[2]/main/div[3]/div/div/div[2]/div[1]/div/button[1]'
+BTN_5MIN_XPATH = '//*[@id="__next"]/main/div[2]/div[2]/main/div[3]/div/div/div[2]/div[1]/div/button[2]'
+# Tab to click before reading each interval table; None reads the table the previous tab left showing
+INTERVAL_BUTTONS = {'3 Min': BTN_3MIN_XPATH, '5 Min': BTN_5MIN_XPATH, '15 Min': None}
+
+# Network capture: build tables from the XHR/fetch JSON the page loads instead of walking the DOM.
+# The patterns pick which captured endpoint feeds which table index; check them against the
+# requests listed in the browser's DevTools Network tab.
+USE_NETWORK_CAPTURE = False
+CAPTURE_TABLE_PATTERNS = {
+    0: re.compile(r"oi[_-]?data", re.IGNORECASE),  # Option-chain table
+    1: re.compile(r"interval|candle|minute", re.IGNORECASE),  # 3/5/15 Min table
+}
+# Table index -> {DOM header: JSON field} for headers whose field name differs from the header text.
+# Headers not listed here are matched to the field with the same name, ignoring case and punctuation.
+CAPTURE_COLUMN_MAPS = {}
 
 # Selenium setup
-def setup_driver():
+def setup_driver(headless=HEADLESS):
     chrome_options = Options()
+    if USE_NETWORK_CAPTURE:
+        chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    if headless:
+        chrome_options.add_argument("--headless=new")
+        chrome_options.add_argument("--window-size=1920,1080")
     driver = webdriver.Chrome(options=chrome_options)
-    driver.maximize_window()
+    if not headless:
+        driver.maximize_window()
     return driver
 
 def login(driver):
@@ -45,7 +103,37 @@ def login(driver):
     submit_button = driver.find_element(By.XPATH, '//*[@id="__next"]/div[2]/div[2]/section[2]/div/form/button')
     submit_button.click()
 
-def sanitize_filename(url, output_dir):
+    # Wait for the login form to go away so the first page load doesn't interrupt the sign-in
+    try:
+        wait.until(EC.invisibility_of_element_located((By.XPATH, '//*[@id="mui-1"]')))
+    except TimeoutException:
+        print("Login form is still visible after submitting; continuing anyway.")
+
+def start_logged_in_driver(headless=HEADLESS):
+    driver = setup_driver(headless)
+    try:
+        login(driver)
+    except Exception:
+        driver.quit()
+        raise
+    return driver
+
+async def create_driver_pool(size=NUM_WORKERS, headless=HEADLESS):
+    """Start and log in `size` browsers concurrently. They are reused for every cycle."""
+    results = await asyncio.gather(
+        *(asyncio.to_thread(start_logged_in_driver, headless) for _ in range(size)),
+        return_exceptions=True,
+    )
+    drivers = [result for result in results if not isinstance(result, BaseException)]
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        for driver in drivers:
+            driver.quit()
+        raise errors[0]
+    return drivers
+
+def instrument_name(url):
+    """The instrument in the URL's category, e.g. "NIFTY " for category=niftyW (the weekly W becomes a space)."""
     match = re.search(r'=(W?)(.*?)&', url)
     if match:
         sheet_name = match.group(2).strip().upper()
@@ -60,8 +148,14 @@ def sanitize_filename(url, output_dir):
     # Truncate the sheet name to ensure it doesn't exceed 31 characters
     if len(sheet_name) >= 31:
         sheet_name = sheet_name[:31]
+    return sheet_name
 
-    base_sheet_name = sheet_name  # Store the original sheet name
+def instrument_key(url):
+    """Stable name of url's instrument for the tick store, whatever workbooks are waiting in INPUT_DIR."""
+    return instrument_name(url).strip()
+
+def sanitize_filename(url, output_dir):
+    base_sheet_name = instrument_name(url)  # Store the original sheet name
     count = 1
     base_filename = os.path.join(output_dir, f"{base_sheet_name}_{count}.xlsx")
 
@@ -81,10 +175,37 @@ def handle_popups(driver):
     except (NoSuchElementException, TimeoutException):
         pass
 
-async def scrape_table(driver, table_index=0):
-    wait = WebDriverWait(driver, 10)
-    tables = wait.until(EC.presence_of_all_elements_located((By.XPATH, '//table')))
-    
+# Pulls the headers and every row's cell text in a single WebDriver round trip.
+# Rows keep the same shape as the element-by-element path: one entry per <tr>,
+# so the header row comes back as an empty list.
+TABLE_EXTRACT_JS = """
+const tables = document.querySelectorAll('table');
+const table = tables[arguments[0]];
+if (!table) { return null; }
+const text = el => (el.innerText || '').trim();
+return {
+    headers: Array.from(table.querySelectorAll('th'), text),
+    rows: Array.from(table.querySelectorAll('tr'), tr => Array.from(tr.querySelectorAll('td'), text)),
+};
+"""
+
+USE_BULK_EXTRACTION = True  # Set to False to force the per-element scraping path
+
+
+def build_table_frame(header_names, data):
+    if header_names:
+        return pd.DataFrame(data, columns=header_names)
+    return pd.DataFrame(data)
+
+def scrape_table_bulk(driver, table_index=0):
+    result = driver.execute_script(TABLE_EXTRACT_JS, table_index)
+    if result is None:
+        return None
+    return build_table_frame(result['headers'], result['rows'])
+
+def scrape_table_elements(driver, table_index=0):
+    tables = driver.find_elements(By.XPATH, '//table')
+
     if len(tables) > table_index:
         table = tables[table_index]
         headers = table.find_elements(By.TAG_NAME, "th")
@@ -98,158 +219,634 @@ async def scrape_table(driver, table_index=0):
             cols = [col.text if col.text.strip() != "" else "" for col in cols]
             data.append(cols)
 
-        if header_names:
-            df = pd.DataFrame(data, columns=header_names)
-        else:
-            df = pd.DataFrame(data)
-
-        return df
+        return build_table_frame(header_names, data)
     else:
         return None
 
-def load_previous_data():
-    if os.path.exists(PREVIOUS_DATA_FILE):
-        with open(PREVIOUS_DATA_FILE, 'r') as f:
-            return json.load(f)
-    return {}
-
-def save_current_data(url, data):
-    previous_data = load_previous_data()
-    previous_data[url] = data[:4]  # Save first 4 rows for comparison
-    with open(PREVIOUS_DATA_FILE, 'w') as f:
-        json.dump(previous_data, f)
+def scrape_table(driver, table_index=0, bulk=None):
+    wait = WebDriverWait(driver, 10)
+    wait.until(EC.presence_of_all_elements_located((By.XPATH, '//table')))
 
+    if bulk is None:
+        bulk = USE_BULK_EXTRACTION
 
-def compare_data(url, new_data):
-    previous_data = load_previous_data()
-    if url in previous_data:
-        for prev, new in zip(previous_data[url], new_data):
-            if prev != new:
+    if bulk:
+        try:
+            return scrape_table_bulk(driver, table_index)
+        except WebDriverException as e:
+            print(f"Bulk table extraction failed, falling back to element scraping: {e}")
+
+    return scrape_table_elements(driver, table_index)
+
+def compare_extraction_timing(driver, table_index=0, repeats=3):
+    """Time the bulk and per-element extraction paths against the current page."""
+    timings = {}
+    for label, bulk in (("bulk", True), ("elements", False)):
+        start_time = time.perf_counter()
+        for _ in range(repeats):
+            data_frame = scrape_table(driver, table_index=table_index, bulk=bulk)
+        timings[label] = (time.perf_counter() - start_time) / repeats
+        shape = data_frame.shape if data_frame is not None else None
+        print(f"{label} extraction of table {table_index}: {timings[label]:.3f} seconds per call, shape {shape}")
+
+    if timings["bulk"] > 0:
+        print(f"Bulk extraction speed-up: {timings['elements'] / timings['bulk']:.1f}x")
+    return timings
+
+class NetworkCapture:
+    """
+    What one driver's performance log has shown so far: JSON responses received but not yet finished, and the
+    newest finished response for each table index. The log can only be read once, so a call for one table must
+    keep the responses for the others.
+    """
+
+    def __init__(self):
+        self.pending = {}  # requestId -> response URL, kept across reads as a response can finish in a later one
+        self.latest = {}  # table index -> (url, body) of the newest response matching its pattern
+
+    def route(self, responses):
+        for response_url, body in responses:
+            for table_index, pattern in CAPTURE_TABLE_PATTERNS.items():
+                if pattern.search(response_url):
+                    self.latest[table_index] = (response_url, body)
+                    break
+
+network_captures = weakref.WeakKeyDictionary()  # driver -> NetworkCapture
+network_captures_lock = threading.Lock()  # Scrape workers add their drivers from their own threads
+
+def network_capture(driver):
+    with network_captures_lock:
+        capture = network_captures.get(driver)
+        if capture is None:
+            capture = network_captures[driver] = NetworkCapture()
+        return capture
+
+def reset_network_capture(driver):
+    """Forget what earlier pages loaded, so tables of the previous URL are never served for the next one."""
+    if USE_NETWORK_CAPTURE:
+        read_captured_responses(driver)
+        capture = network_capture(driver)
+        capture.pending.clear()  # Requests of the old page that never finish would otherwise stay forever
+        capture.latest.clear()
+
+def read_captured_responses(driver):
+    """Drain the performance log and return (url, body) for every JSON response finished since the last call."""
+    pending = network_capture(driver).pending
+    finished = []
+    for entry in driver.get_log("performance"):
+        message = json.loads(entry["message"])["message"]
+        params = message.get("params", {})
+        if message.get("method") == "Network.responseReceived":
+            response = params["response"]
+            if "json" in response.get("mimeType", ""):
+                pending[params["requestId"]] = response["url"]
+        elif message.get("method") == "Network.loadingFinished" and params.get("requestId") in pending:
+            finished.append(params["requestId"])
+        elif message.get("method") == "Network.loadingFailed":
+            pending.pop(params.get("requestId"), None)  # No body will come
+
+    responses = []
+    for request_id in finished:
+        response_url = pending.pop(request_id)
+        try:
+            result = driver.execute_cdp_cmd("Network.getResponseBody", {"requestId": request_id})
+        except WebDriverException:
+            continue  # Chrome already evicted the body
+        body = result["body"]
+        if result.get("base64Encoded"):
+            body = base64.b64decode(body).decode("utf-8")
+        responses.append((response_url, body))
+    return responses
+
+def find_table_records(payload):
+    """Breadth-first search for the first list of row objects in a decoded JSON payload."""
+    queue = deque([payload])
+    while queue:
+        node = queue.popleft()
+        if isinstance(node, list):
+            if node and all(isinstance(item, dict) for item in node):
+                return node
+            queue.extend(item for item in node if isinstance(item, (dict, list)))
+        elif isinstance(node, dict):
+            queue.extend(value for value in node.values() if isinstance(value, (dict, list)))
+    return None
+
+def parse_table_payload(body):
+    payload = json.loads(body) if isinstance(body, (str, bytes)) else body
+    records = find_table_records(payload)
+    if records is None:
+        return None
+    # object dtype keeps the JSON values as sent, so a null does not turn a column of integers into floats
+    return pd.DataFrame(records, dtype=object)
+
+def normalize_column_name(name):
+    return re.sub(r'[^0-9a-z]+', '', str(name).lower())
+
+def captured_table_frame(records, headers, column_map=None):
+    """
+    Shape a captured payload like scrape_table's DOM frame: the DOM headers in DOM order, an empty first row (the
+    header <tr>) and cell text instead of JSON numbers, so the renderer's positional styling still lines up.
+    Returns None when a header has no matching field.
+
+    :param records: DataFrame from parse_table_payload.
+    :param headers: The table's <th> texts, in page order.
+    :param column_map: Optional {header: field} for fields named differently from their header.
+    """
+    if not headers:
+        return None
+    column_map = column_map or {}
+    fields = {normalize_column_name(column): column for column in records.columns}
+    columns = []
+    for header in headers:
+        field = column_map.get(header)
+        if field is None:
+            field = fields.get(normalize_column_name(header))
+        if field not in records.columns:
+            print(f"Captured response has no field for column {header!r}")
+            return None
+        columns.append(field)
+    rows = [[]] + [["" if value is None or value != value else str(value) for value in row]
+                   for row in records[columns].itertuples(index=False)]
+    return build_table_frame(list(headers), rows)
+
+TABLE_HEADERS_JS = """
+const table = document.querySelectorAll('table')[arguments[0]];
+return table ? Array.from(table.querySelectorAll('th'), el => (el.innerText || '').trim()) : null;
+"""
+
+def capture_network_table(driver, table_index=0):
+    """
+    Return the table_index table built from the newest captured response for it, or None. Responses for the other
+    tables read from the log meanwhile are kept for their own calls.
+    """
+    if table_index not in CAPTURE_TABLE_PATTERNS:
+        return None
+    capture = network_capture(driver)
+    capture.route(read_captured_responses(driver))
+    if table_index not in capture.latest:
+        return None
+    response_url, body = capture.latest[table_index]
+    try:
+        records = parse_table_payload(body)
+    except ValueError as e:
+        print(f"Could not parse captured response from {response_url}: {e}")
+        return None
+    if records is None:
+        return None
+    headers = driver.execute_script(TABLE_HEADERS_JS, table_index)
+    return captured_table_frame(records, headers, CAPTURE_COLUMN_MAPS.get(table_index))
+
+def save_captured_responses(driver, fixture_dir):
+    """Dump the captured JSON bodies so the parser can be replayed offline."""
+    os.makedirs(fixture_dir, exist_ok=True)
+    paths = []
+    responses = read_captured_responses(driver)
+    network_capture(driver).route(responses)  # Still serve them to extract_table
+    for count, (response_url, body) in enumerate(responses, start=1):
+        path = os.path.join(fixture_dir, f"{count:03}_{re.sub(r'[^A-Za-z0-9]+', '_', response_url)[-80:]}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(body)
+        paths.append(path)
+    return paths
+
+def replay_captured_responses(fixture_dir):
+    """Parse saved response bodies with the same code used on live captures."""
+    tables = {}
+    for filename in sorted(os.listdir(fixture_dir)):
+        if filename.endswith('.json'):
+            with open(os.path.join(fixture_dir, filename), encoding='utf-8') as f:
+                tables[filename] = parse_table_payload(f.read())
+    return tables
+
+@metrics.timed('scrape.extract')
+def extract_table(driver, table_index=0):
+    if USE_NETWORK_CAPTURE:
+        data_frame = capture_network_table(driver, table_index)
+        if data_frame is not None:
+            return data_frame
+    return scrape_table(driver, table_index)
+
+# Row count plus the rendered text is enough to notice both a content and a structure change.
+# Empty while the table has no data row yet (only a header, or a loading row spanning the columns)
+TABLE_SIGNATURE_JS = """
+const table = document.querySelectorAll('table')[arguments[0]];
+if (!table) { return null; }
+const columns = table.rows.length ? table.rows[0].cells.length : 0;
+const hasData = Array.from(table.rows).slice(1).some(
+    row => row.cells.length === columns && Array.from(row.cells).some(cell => cell.innerText.trim() !== ''));
+if (!hasData) { return ''; }
+return table.rows.length + '|' + table.innerText;
+"""
+
+table_wait_log = deque(maxlen=1000)  # (label, seconds waited) for the most recent tab switches
+
+def table_signature(driver, table_index):
+    return driver.execute_script(TABLE_SIGNATURE_JS, table_index)
+
+class TableSettled:
+    """
+    Wait condition: the table has data, differs from previous_signature and read the same on two polls in a row,
+    so a table that is still loading or filling in does not count as the new one.
+    """
+
+    def __init__(self, table_index, previous_signature):
+        self.table_index = table_index
+        self.previous_signature = previous_signature
+        self.last_signature = None
+
+    def __call__(self, driver):
+        signature = table_signature(driver, self.table_index)
+        settled = bool(signature) and signature != self.previous_signature and signature == self.last_signature
+        self.last_signature = signature
+        return settled
+
+def wait_for_table_change(driver, table_index, previous_signature, timeout=TABLE_CHANGE_TIMEOUT):
+    """Return as soon as the table has changed from previous_signature and settled, or after timeout seconds."""
+    start_time = time.perf_counter()
+    try:
+        WebDriverWait(driver, timeout, poll_frequency=TABLE_CHANGE_POLL).until(
+            TableSettled(table_index, previous_signature))
+    except TimeoutException:
+        print(f"Table {table_index} did not change within {timeout} seconds")
+    return time.perf_counter() - start_time
+
+def is_tab_selected(button):
+    classes = button.get_attribute("class") or ""
+    return button.get_attribute("aria-pressed") == "true" or "Mui-selected" in classes
+
+def switch_interval_tab(driver, button_xpath, label, table_index=1, timeout=TABLE_CHANGE_TIMEOUT):
+    """Click an interval button and wait for the table it drives to redraw."""
+    button = driver.find_element(By.XPATH, button_xpath)
+    if is_tab_selected(button):
+        # The table already shows this interval, so clicking won't change anything to wait for
+        table_wait_log.append((label, 0.0))
+        metrics.observe('scrape.tab_switch', 0.0)
+        return 0.0
+
+    previous_signature = table_signature(driver, table_index)
+    button.click()
+    waited = wait_for_table_change(driver, table_index, previous_signature, timeout)
+    table_wait_log.append((label, waited))
+    metrics.observe('scrape.tab_switch', waited)
+    print(f"{label} table updated after {waited:.2f} seconds")
+    return waited
+
+def summarize_table_waits():
+    if not table_wait_log:
+        return
+    waits = [waited for _, waited in table_wait_log]
+    average = sum(waits) / len(waits)
+    saved = sum(max(FIXED_TAB_DELAY - waited, 0) for waited in waits)
+    print(f"Tab switch wait: {average:.2f} seconds on average over {len(waits)} switches, "
+          f"{saved:.1f} seconds saved compared to a fixed {FIXED_TAB_DELAY} second sleep")
+
+def frame_digest(data_frame):
+    """Hash of the whole table: headers plus every cell."""
+    hasher = hashlib.sha1()
+    hasher.update("\x1f".join(map(str, data_frame.columns)).encode("utf-8"))
+    try:
+        cell_hashes = pd.util.hash_pandas_object(data_frame, index=False)
+    except TypeError:
+        # Unhashable cells (lists or dicts from captured JSON) are compared by their text
+        cell_hashes = pd.util.hash_pandas_object(data_frame.astype(str), index=False)
+    hasher.update(cell_hashes.values.tobytes())
+    return hasher.hexdigest()
+
+def sheets_fingerprint(named_sheets):
+    """
+    Hash of a whole workbook: every sheet's name and frame_digest. It is computed once here and carried with the
+    sheets (in the xlsx keywords, then in the image metadata) so the render and post stages can skip repeats.
+    """
+    hasher = hashlib.sha1()
+    for sheet_name, data_frame in named_sheets.items():
+        hasher.update(f"{sheet_name}\x1e{frame_digest(data_frame)}\x1d".encode("utf-8"))
+    return hasher.hexdigest()
+
+def has_data(data_frame):
+    """True if any cell holds a value. Rows of blanks count as empty, as they would once written to xlsx."""
+    return bool(data_frame.replace("", None).notna().to_numpy().any())
+
+class ChangeDetector:
+    """Keeps the last table digest per URL in memory and mirrors it to PREVIOUS_DATA_FILE."""
+
+    def __init__(self, path=PREVIOUS_DATA_FILE):
+        self.path = path
+        self.lock = threading.Lock()  # Scrape workers share one detector
+        self.digests = self.load()
+        self.skipped = 0  # Scrapes cut short because the option table was unchanged
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as f:
+                previous_data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable {self.path}: {e}")
+            return {}
+        # Older files stored the first rows instead of a digest; those entries just count as changed
+        return {url: digest for url, digest in previous_data.items() if isinstance(digest, str)}
+
+    def is_unchanged(self, url, digest):
+        with self.lock:
+            if self.digests.get(url) != digest:
                 return False
+            self.skipped += 1
+        metrics.count('scrape.unchanged')
         return True
-    return False
 
+    def update(self, url, digest):
+        """Record the digest for url. The file is only rewritten when the digest actually changed."""
+        with self.lock:
+            if self.digests.get(url) == digest:
+                return False
+            self.digests[url] = digest
+            self.save()
+        return True
 
-async def scrape_and_process_tab(driver, url):
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.previous_data.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.digests, f)
+            os.replace(temp_path, self.path)  # Atomic, so a crash never leaves a half-written file
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+
+interval_frames = {}  # url -> the interval tables from its last successful scrape, reused until their candle closes
+
+def due_intervals(url, intervals):
+    """
+    Interval labels to scrape for url: all of them when intervals is None, else the ones in intervals plus any
+    with nothing cached yet.
+    """
+    cached = interval_frames.get(url, {})
+    due = {label for label in INTERVAL_BUTTONS
+           if intervals is None or label in intervals or cached.get(label) is None}
+    if '15 Min' in due:
+        due.add('5 Min')  # The 15 Min table is read from the page the 5 Min tab leaves
+    return due
+
+def scrape_instrument(driver, url, change_detector, intervals=None):
+    """
+    Scrape the option table and the 3/5/15 Min tables for url.
+
+    :param intervals: Labels of the interval tables whose candle just closed; only their tabs are opened and the
+        others are taken from the last scrape of url. None scrapes every interval table. The instrument is
+        skipped when its option table is unchanged, unless a candle closed on one of its due tables.
+
+    Returns (sheets, digest), where sheets maps "Option", "3 Min", "5 Min" and "15 Min" to DataFrames,
+    or (None, None) when the data is unchanged, insufficient or could not be scraped.
+    """
     retry_count = 3
     while retry_count > 0:
         try:
-            # Start timing
-            start_time = time.time()
-
-            driver.get(url)
-            wait = WebDriverWait(driver, 10)
-            wait.until(EC.presence_of_element_located((By.XPATH, '//table')))
-            handle_popups(driver)
-
-            sheet_name = sanitize_filename(url, INPUT_DIR)
-            excel_path = os.path.join(INPUT_DIR, f"{sheet_name}.xlsx")
-
-            with pd.ExcelWriter(excel_path, engine='xlsxwriter') as writer:
-                data_frame = await scrape_table(driver, table_index=0)
-                if data_frame is not None:
-                    first_rows_data = data_frame.iloc[:4].values.tolist()  # Get the first 4 rows of data
-
-                    if compare_data(url, first_rows_data):
-                        print(f"Skipping scraping for {url} as the data hasn't changed.")
-                        os.remove(excel_path)  # Remove the file if the data hasn't changed
-                        return None, None
-                    
-                    else:
-                        data_frame.to_excel(writer, sheet_name=sheet_name + "Option", index=False)
-                        save_current_data(url, first_rows_data)
-                        print(f"Scraped and saved data from {url}")
-                    
-                btn_3min_xpath = '//*[@id="__next"]/main/div[2]/div[2]/main/div[3]/div/div/div[2]/div[1]/div/button[1]'
-                driver.find_element(By.XPATH, btn_3min_xpath).click()
-                time.sleep(5)
-                data_frame = await scrape_table(driver, table_index=1)
-                if data_frame is not None:
-                    data_frame.to_excel(writer, sheet_name='3 Min', index=False)
-
-                btn_5min_xpath = '//*[@id="__next"]/main/div[2]/div[2]/main/div[3]/div/div/div[2]/div[1]/div/button[2]'
-                driver.find_element(By.XPATH, btn_5min_xpath).click()
-                time.sleep(5)
-                data_frame = await scrape_table(driver, table_index=1)
-                if data_frame is not None:
-                    data_frame.to_excel(writer, sheet_name='5 Min', index=False)
-
-                data_frame = await scrape_table(driver, table_index=1)
-                if data_frame is not None:
-                    data_frame.to_excel(writer, sheet_name='15 Min', index=False)
-            
-           
-            
-            # Check if the Excel file is empty or contains fewer than 3 non-empty sheets
-            if os.path.exists(excel_path):
-                excel_file = pd.ExcelFile(excel_path)
-                sheet_names = excel_file.sheet_names
-                if len(sheet_names) < 3 or all([pd.read_excel(excel_file, sheet).empty for sheet in sheet_names]):
-                    os.remove(excel_path)
-                    print(f"Removed file due to insufficient data or being empty: {excel_path}")
-                else:
-                    print(f"File saved with sufficient tables: {excel_path}")
-
-             # End timing
-            end_time = time.time()
-            time_taken = end_time - start_time
-            
-
-            print(f"Time taken for {url}: {time_taken:.2f} seconds")
-
-            return excel_path, sheet_name
+            with metrics.timer('scrape.navigate'):
+                reset_network_capture(driver)
+                driver.get(url)
+                wait = WebDriverWait(driver, 10)
+                wait.until(EC.presence_of_element_located((By.XPATH, '//table')))
+                handle_popups(driver)
+
+            # Scrape and compare before touching the disk, so an unchanged instrument costs no file I/O
+            digest = None
+            due = due_intervals(url, intervals)
+            candle_closed = intervals is not None and bool(due)
+            option_frame = extract_table(driver, table_index=0)
+            if option_frame is not None:
+                with metrics.timer('scrape.change_detect'):
+                    digest = frame_digest(option_frame)
+                    unchanged = not candle_closed and change_detector.is_unchanged(url, digest)
+                if unchanged:
+                    print(f"Skipping scraping for {url} as the data hasn't changed.")
+                    return None, None
+
+            sheets = {'Option': option_frame}
+            for label, button in INTERVAL_BUTTONS.items():
+                if label not in due:
+                    sheets[label] = interval_frames[url][label]
+                    continue
+                if button is not None:
+                    switch_interval_tab(driver, button, label)
+                sheets[label] = extract_table(driver, table_index=1)
+
+            sheets = {label: data_frame for label, data_frame in sheets.items() if data_frame is not None}
+
+            # Check for fewer than 3 sheets or no data at all before anything is written
+            if len(sheets) < 3 or not any(has_data(data_frame) for data_frame in sheets.values()):
+                print(f"Not saving {url} due to insufficient data or being empty.")
+                return None, None
+
+            interval_frames[url] = {label: sheets.get(label) for label in INTERVAL_BUTTONS}
+            return sheets, digest
         except StaleElementReferenceException:
             retry_count -= 1
+            metrics.count('scrape.retries')
             print(f"Retrying scraping {url} due to stale element reference ({3 - retry_count}/3)")
         except Exception as e:
             print(f"Error scraping {url}: {e}")
+            metrics.count('scrape.errors')
             break
     return None, None
 
-async def process_tabs(driver, urls):
-    tasks = []
-    
-    for url in urls:
-        driver.execute_script(f"window.open('{url}', '_blank');")
-        await asyncio.sleep(2)  # Introduce a small delay between opening tabs
-
-    await asyncio.sleep(10)  # Wait for all tabs to load
+def name_sheets(sheets, sheet_name):
+    """Workbook sheet names: the option table is named after the instrument, the others after their interval."""
+    return {(sheet_name + "Option" if label == 'Option' else label): data_frame for label, data_frame in sheets.items()}
+
+@metrics.timed('scrape.xlsx_write')
+def write_workbook(named_sheets, excel_path, fingerprint=None):
+    with pd.ExcelWriter(excel_path, engine='xlsxwriter') as writer:
+        if fingerprint:
+            writer.book.set_properties({'keywords': FINGERPRINT_PREFIX + fingerprint})
+        for sheet_name, data_frame in named_sheets.items():
+            data_frame.to_excel(writer, sheet_name=sheet_name, index=False)
+
+def record_ticks(url, sheets):
+    # Only queues the snapshot; the tick store writes it on its own thread
+    if tick_store is not None:
+        tick_store.append(instrument_key(url), sheets)
+
+@metrics.timed('scrape.instrument')
+def scrape_and_process_tab(driver, url, change_detector, intervals=None):
+    sheets, digest = scrape_instrument(driver, url, change_detector, intervals)
+    if sheets is None:
+        return None, None
+    record_ticks(url, sheets)
 
-    for handle in driver.window_handles:
-        driver.switch_to.window(handle)
+    try:
+        sheet_name = sanitize_filename(url, INPUT_DIR)
+        excel_path = os.path.join(INPUT_DIR, f"{sheet_name}.xlsx")
+        named_sheets = name_sheets(sheets, sheet_name)
+        write_workbook(named_sheets, excel_path, sheets_fingerprint(named_sheets))
+    except Exception as e:
+        print(f"Error saving {url}: {e}")
+        return None, None
+
+    if digest is not None:
+        change_detector.update(url, digest)
+    print(f"File saved with sufficient tables: {excel_path}")
+    metrics.count('scrape.saved')
+    return excel_path, sheet_name
+
+@metrics.timed('scrape.instrument')
+def scrape_tab_frames(driver, url, change_detector, intervals=None):
+    """
+    In-process variant of scrape_and_process_tab: returns (sheet_name, named sheets, fingerprint) without writing
+    a workbook.
+    """
+    sheets, digest = scrape_instrument(driver, url, change_detector, intervals)
+    if sheets is None:
+        return None, None, None
+
+    sheet_name = sanitize_filename(url, INPUT_DIR)
+    record_ticks(url, sheets)
+    if digest is not None:
+        change_detector.update(url, digest)
+    named_sheets = name_sheets(sheets, sheet_name)
+    return sheet_name, named_sheets, sheets_fingerprint(named_sheets)
+
+async def process_tabs(drivers, urls, change_detector, scrape=scrape_and_process_tab, on_result=None):
+    """
+    Scrape every URL on the first idle driver. Selenium calls block, so each one runs in a worker thread.
+
+    :param scrape: Called as scrape(driver, url, change_detector) for every URL.
+    :param on_result: Optional coroutine function awaited with each result as soon as it is ready.
+    """
+    idle_drivers = asyncio.Queue()
+    for driver in drivers:
+        idle_drivers.put_nowait(driver)
+
+    async def run(url):
+        driver = await idle_drivers.get()
         try:
-            if driver.current_url in urls:
-                tasks.append(asyncio.create_task(scrape_and_process_tab(driver, driver.current_url)))
-        except Exception as e:
-            print(f"Error processing tab: {e}")
-
-    await asyncio.gather(*tasks)
+            result = await asyncio.to_thread(scrape, driver, url, change_detector)
+        finally:
+            idle_drivers.put_nowait(driver)
+        if on_result is not None:
+            await on_result(result)
+        return result
+
+    return await asyncio.gather(*(run(url) for url in urls))
+
+cycle_log = deque(maxlen=1000)  # (fire time, intervals, seconds late starting, seconds taken) per scheduled cycle
+
+def next_candle_close(now, offset=CANDLE_OFFSET):
+    """
+    The first candle close after now, counting candles from MARKET_OPEN, shifted by offset seconds.
+
+    Returns (fire time, labels of the intervals whose candle closes then).
+    """
+    session_open = datetime.combine(now.date(), MARKET_OPEN) + timedelta(seconds=offset)
+    minute = max((now - session_open) // timedelta(minutes=1) + 1, 1)
+    while True:
+        closing = [label for label, minutes in CANDLE_MINUTES.items() if minute % minutes == 0]
+        if closing:
+            return session_open + timedelta(minutes=minute), closing
+        minute += 1
+
+def closes_between(start, end):
+    """Labels of every interval with a candle close (plus offset) after start and up to end."""
+    closed = set()
+    fire_at, closing = next_candle_close(start)
+    while fire_at <= end:
+        closed.update(closing)
+        fire_at, closing = next_candle_close(fire_at)
+    return closed
+
+def summarize_cycles():
+    if not cycle_log:
+        return
+    fire_at, intervals, late, taken = cycle_log[-1]
+    worst = max(cycle_late for _, _, cycle_late, _ in cycle_log)
+    print(f"Cycle for the {fire_at:%H:%M:%S} close ({', '.join(intervals)}) started {late:.2f} seconds late and "
+          f"took {taken:.2f} seconds; latest start so far {worst:.2f} seconds")
+
+async def run_cycles(drivers, change_detector, end_time, scrape=scrape_and_process_tab, on_result=None):
+    """
+    Scrape URLS in cycles until end_time, on the candle schedule when USE_CANDLE_SCHEDULE is set.
+
+    :param scrape: Called as scrape(driver, url, change_detector, intervals=...) for every URL.
+    :param on_result: Passed on to process_tabs.
+    """
+    missed = set()  # Intervals whose close went by while a cycle was still running
+    while datetime.now() < end_time:
+        intervals = None
+        if USE_CANDLE_SCHEDULE:
+            fire_at, closing = next_candle_close(datetime.now())
+            if fire_at >= end_time:
+                break
+            intervals = [label for label in CANDLE_MINUTES if label in closing or label in missed]
+            await asyncio.sleep(max((fire_at - datetime.now()).total_seconds(), 0))
+            late = (datetime.now() - fire_at).total_seconds()
+
+        cycle_start = time.time()
+        await process_tabs(drivers, URLS, change_detector, scrape=partial(scrape, intervals=intervals),
+                           on_result=on_result)
+        taken = time.time() - cycle_start
+        print(f"Cycle over {len(URLS)} URLs took {taken:.2f} seconds")
+        print(f"Scrape: {change_detector.skipped} unchanged instruments skipped so far")
+        summarize_table_waits()
+        metrics.summarize()
+
+        metrics.observe('scrape.cycle', taken)
+        if USE_CANDLE_SCHEDULE:
+            metrics.observe('scrape.schedule_lag', late)
+            cycle_log.append((fire_at, intervals, late, taken))
+            summarize_cycles()
+            missed = closes_between(fire_at, datetime.now())
+            if missed:
+                print(f"Cycle ran past the next close; {', '.join(sorted(missed))} will be scraped at the one after")
+        else:
+            await asyncio.sleep(FIXED_CYCLE_DELAY)
 
 
 async def main():
-    driver = setup_driver()
+    global tick_store
     end_time = datetime.now() + timedelta(hours=5)
 
     start_time = datetime.now()  # Record start time
 
+    change_detector = ChangeDetector()
+    if RECORD_TICKS:
+        tick_store = TickStore()
+    metrics.start_exporters(METRICS_PORT, METRICS_JSONL)
+    drivers = await create_driver_pool(NUM_WORKERS)
     try:
-        login(driver)
-        while datetime.now() < end_time:
-            urls = [
-                "https://theautotrender.com/derivative?category=niftyW&id=OIData",
-                "https://theautotrender.com/derivative?category=bankNiftyW&id=OIDataW",
-                "https://theautotrender.com/derivative?category=FINNiftyW&id=OIData",
-            ]
-            await process_tabs(driver, urls)
-            await asyncio.sleep(60)
+        await run_cycles(drivers, change_detector, end_time)
 
     finally:
-        driver.quit()
+        for driver in drivers:
+            driver.quit()
+        if tick_store is not None:
+            tick_store.close()
     
     end_time = datetime.now()  # Record end time
     total_time = end_time - start_time  # Calculate elapsed time
     print(f"Total time taken: {total_time}")
 
+def compare_extraction(url):
+    """Load url in one logged-in browser and time the bulk and per-element extraction of both tables."""
+    driver = start_logged_in_driver()
+    try:
+        driver.get(url)
+        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.XPATH, '//table')))
+        handle_popups(driver)
+        for table_index in (0, 1):
+            compare_extraction_timing(driver, table_index=table_index)
+    finally:
+        driver.quit()
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    if len(sys.argv) in (2, 3) and sys.argv[1] == '--compare-extraction':
+        compare_extraction(sys.argv[2] if len(sys.argv) == 3 else URLS[0])
+    elif len(sys.argv) == 1:
+        asyncio.run(main())
+    else:
+        print("Usage:")
+        print("Scrape: python database_trial_main.py")
+        print("Extraction timing: python database_trial_main.py --compare-extraction [url]")
+        sys.exit(1)
 
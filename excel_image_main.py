@@ -1,10 +1,55 @@
 import pandas as pd
-import matplotlib.pyplot as plt
+import numpy as np
+import matplotlib
+import openpyxl
+import matplotlib.figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from matplotlib.table import Table
+import io
 import os
 import sys
+import tempfile
+import zipfile
+import zlib
 from matplotlib.patches import Rectangle
+from matplotlib import font_manager
+from PIL import Image, ImageDraw, ImageFont
+from PIL.PngImagePlugin import PngInfo
 import re
+import threading
+import multiprocessing
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler
+
+import metrics
+from fingerprints import EXIF_IMAGE_DESCRIPTION, FINGERPRINT_PREFIX
+
+STABLE_CHECK_INTERVAL = 0.2  # Seconds between size/mtime checks of a workbook that is still being written
+PROCESSED_HISTORY = 1000  # Number of processed workbook versions remembered
+RENDER_WORKERS = min(4, os.cpu_count() or 1)  # Workbooks rendered in parallel
+# 'matplotlib', 'pil' (faster, draws the same layout with Pillow) or 'incremental' (Pillow, redraws only changed cells)
+RENDER_BACKEND = 'matplotlib'
+SELECTIVE_LOAD = True  # Read only the first 20 rows of each sheet, and only once the time gate has passed
+OUTPUT_FORMAT = 'JPEG'  # 'PNG', 'JPEG' or 'WEBP'; JPEG is what the poster used to convert every image to
+OUTPUT_DPI = 300
+OUTPUT_QUALITY = 95  # JPEG and WebP quality
+PNG_COMPRESS_LEVEL = 6  # 0-9; 1 encodes several times faster for a somewhat larger file
+MAX_OUTPUT_BYTES = 10 * 1024 * 1024  # Telegram's photo limit; quality, then resolution, is lowered to fit
+MIN_OUTPUT_QUALITY = 60
+IMAGE_EXTENSIONS = {'PNG': '.png', 'JPEG': '.jpg', 'WEBP': '.webp'}
+PIL_DPI = OUTPUT_DPI
+METRICS_PORT = 9109  # Prometheus text endpoint for the render metrics (see metrics.py); None turns it off
+METRICS_JSONL = 'metrics_render.jsonl'  # JSONL snapshots of the same metrics, rotated by size; None turns them off
+TEMPLATE_CACHE_SIZE = 4  # Prebuilt matplotlib figures kept per process, one per sheet count and table shapes
+
+HEADER_COLOR = '#333333'
+HEADER_FONT_COLOR = '#ffffff'
+GRID_COLOR = '#444444'
+BANNER_TEXT = "USE DATA AFTER 10:30 AM"
+WATERMARK_TEXT = "Sample Data"
 
 def clean_sheet_name(sheet_name):
     """Clean the sheet name by removing digits and special symbols after the first string."""
@@ -39,6 +84,71 @@ def format_time(value):
         print(f"Error formatting value: {value}")
     return value
 
+def format_time_column(values):
+    """
+    format_time over a whole column at once, and HH:MM:SS text to HH:MM AM/PM as well.
+
+    Numbers and integer text are truncated to an integer; four digits read as HHMM and two as HH, any other
+    integer comes back as its text. Everything else (blanks, text that is already formatted) is left alone.
+    """
+    result = values.astype(object)
+    is_text = values.apply(isinstance, args=(str,)).to_numpy(dtype=bool)
+    is_number = values.apply(isinstance, args=((int, float, np.integer, np.floating),)).to_numpy(dtype=bool)
+    text = values.where(is_text).astype(object)
+
+    integer_text = is_text & text.str.fullmatch(r'\s*[+-]?\d+\s*', na=False).to_numpy(dtype=bool)
+    numbers = pd.to_numeric(values.where(is_number | integer_text), errors='coerce')
+    is_integer = (is_number | integer_text) & numbers.notna().to_numpy() & np.isfinite(numbers.fillna(0)).to_numpy()
+    if is_integer.any():
+        digits = np.trunc(numbers[is_integer]).astype('int64').astype(str)
+        four = digits.str.fullmatch(r'\d{4}').to_numpy()
+        two = digits.str.fullmatch(r'\d{2}').to_numpy()
+        hours = pd.to_numeric(digits.str[:2].where(four | two), errors='coerce').fillna(0).astype(int).to_numpy()
+        periods = np.where(hours < 12, ' AM', ' PM')
+        hours = np.where(hours == 0, 12, np.where(hours > 12, hours - 12, hours))
+        minutes = np.where(four, digits.str[2:], '00')
+        formatted = [f"{hour:02}:{minute}{period}" for hour, minute, period in zip(hours, minutes, periods)]
+        result[is_integer] = np.where(four | two, formatted, digits.to_numpy())
+
+    clock_text = is_text & text.str.fullmatch(r'\s*\d{1,2}:\d{2}:\d{2}\s*', na=False).to_numpy(dtype=bool)
+    if clock_text.any():
+        clock = pd.to_datetime(text[clock_text].str.strip(), format='%H:%M:%S', errors='coerce')
+        valid = clock.notna().to_numpy()
+        result[np.flatnonzero(clock_text)[valid]] = clock[valid].dt.strftime('%I:%M %p').to_numpy()
+    return result
+
+
+def format_time_columns(df):
+    """The Time column of sheets 1-3 formatted once per workbook: sheet index -> formatted column."""
+    time_columns = {}
+    for sheet_index, data in enumerate(list(df.values())[1:4], start=1):
+        if 'Time' in data.columns:
+            time_columns[sheet_index] = format_time_column(data.iloc[:, data.columns.get_loc('Time')])
+    return time_columns
+
+
+def time_gate(df, time_columns, current_time):
+    """
+    Sheet indexes with a Time column (from format_time_columns) and the position among them of the first sheet
+    whose first row is empty and whose second row holds current_time, or None when there is no such sheet.
+    """
+    sheets = list(df.values())
+    checked = sorted(time_columns)
+    for position, sheet_index in enumerate(checked):
+        data = sheets[sheet_index]
+        if len(data) > 1 and data.iloc[0].isna().all() and time_columns[sheet_index].iloc[1] == current_time:
+            return checked, position
+    return checked, None
+
+
+def set_time_rows(data, formatted, rows):
+    """Replace the given rows of data's Time column with their formatted values, in place."""
+    time_column_index = data.columns.get_loc('Time')
+    column = data.iloc[:, time_column_index].astype(object)
+    column.iloc[rows] = formatted.iloc[rows]
+    data.isetitem(time_column_index, column)
+
+
 def get_current_time_formatted():
     """Get the current time formatted as HH:MM AM/PM."""
     return time.strftime("%I:%M %p")
@@ -58,307 +168,1021 @@ def add_watermark(ax, watermark_text, fontsize=0, opacity=0.3):
              transform=fig.transFigure, zorder=10, fontweight='bold')
 
 
-def excel_to_table_image(excel_file, output_dir):
-    start_time = time.time()  # Start timing the processing
-    image_file = os.path.join(output_dir, f"{os.path.splitext(os.path.basename(excel_file))[0]}.png")
- 
- 
-    # Remove the previous output image or any other relevant file before starting the process
-    if os.path.exists(image_file):
-        os.remove(image_file)
-        
-    # Remove the existing image file if it exists
-    if os.path.exists(image_file):
-        os.remove(image_file)
+def negative_number_mask(values):
+    """Cells holding an int or float below zero; numeric text doesn't count."""
+    if pd.api.types.is_numeric_dtype(values):
+        return (values < 0).to_numpy()
+    is_number = values.apply(isinstance, args=((int, float),)).to_numpy(dtype=bool)
+    numbers = pd.to_numeric(values.where(is_number), errors='coerce')
+    return is_number & (numbers < 0).to_numpy()
+
 
+def compute_cell_styles(data, sheet_index):
+    """
+    Work out the text, background and font color of every body cell of a sheet in one pass over its columns.
+
+    :param data: The sheet's rows as they will be drawn (already cut to 20 rows).
+    :param sheet_index: Position of the sheet in the workbook; sheet 0 is the option chain.
+    :return: (texts, face_colors, font_colors), each an array shaped like data.
+    """
+    data = data.copy()
+    nrows, ncols = data.shape
+    rows = np.arange(nrows)[:, None]
+    cols = np.arange(ncols)[None, :]
+
+    # Clean the 5th column (percentages) for the median calculation; the cleaned values are also what gets drawn
+    median_row_index = None
+    if sheet_index == 0 and ncols > 5:
+        percentages = data.iloc[:, 5].astype(str).str.replace('%', '', regex=False).replace('-', '', regex=False)
+        data.isetitem(5, pd.to_numeric(percentages, errors='coerce'))
+        median_value = data.iloc[:, 5].median()
+        median_row = data[data.iloc[:, 5] == median_value].index.tolist()
+        if median_row:
+            median_row_index = median_row[0]
+
+    raw_text = data.astype(str).to_numpy()
+    texts = data.astype(object).where(data.notna(), '').astype(str).to_numpy()
+
+    # Alternate background colors for rows, light gray text by default
+    face_colors = np.where(rows % 2 == 0, 'black', '#333333').repeat(ncols, axis=1).astype(object)
+    font_colors = np.full((nrows, ncols), '#cccccc', dtype=object)
+
+    total_cells = np.zeros((nrows, ncols), dtype=bool)
+    if sheet_index == 0:
+        total_cells = np.char.find(raw_text.astype(str), 'Total') >= 0
+    face_colors[total_cells] = '#FFFF00'
+    font_colors[total_cells] = '#000000'
+
+    # Green for the signal columns, red where they hold negative numbers
+    signal_columns = [2, 6] if sheet_index == 0 else [3, 4, 5, 8]
+    for j in signal_columns:
+        if j < ncols:
+            negative = negative_number_mask(data.iloc[:, j])
+            font_colors[:, j] = np.where(negative, '#ff0000', '#00ff00')
+
+    # "sell" in the signal columns of the interval sheets
+    if sheet_index != 0:
+        for j in [5, 8]:
+            values = data.iloc[:, j] if j < ncols else None
+            if values is not None and not pd.api.types.is_numeric_dtype(values):
+                text = values.where(values.apply(isinstance, args=(str,))).astype(object)
+                sell = text.str.lower().str.contains('sell', regex=False, na=False)
+                font_colors[sell.to_numpy(dtype=bool), j] = '#ff0000'
+
+    # Highlight the 4th column of the row holding the median percentage
+    if median_row_index is not None and ncols > 4:
+        median_cells = (rows == median_row_index) & (cols == 4)
+        face_colors[median_cells] = '#FFFF00'
+        font_colors[median_cells] = '#000000'
+
+    # Highlight the maximum values of columns 1 and 7
+    if sheet_index == 0 and ncols > 7:
+        for j in [1, 7]:
+            is_max = (data.iloc[:, j] == data.iloc[:, j].max()).to_numpy(dtype=bool)
+            font_colors[is_max, j] = '#FFFF00'
+
+    # A "Total" cell turns the text of every cell to its left yellow
+    last_total = np.where(total_cells.any(axis=1), ncols - 1 - np.argmax(total_cells[:, ::-1], axis=1), -1)
+    font_colors[cols < last_total[:, None]] = '#FFFF00'
+
+    return texts, face_colors, font_colors
+
+
+def benchmark_cell_styles(rows=20, cols=12, repeats=200):
+    """Time compute_cell_styles and the table drawing for a synthetic rows x cols option-chain sheet."""
+    rng = np.random.default_rng(0)
+    data = pd.DataFrame(rng.integers(-500, 500, size=(rows, cols)).astype(float),
+                        columns=[f"Col {j}" for j in range(cols)])
+    data = data.astype(object)
+    data.iloc[rows // 2, 0] = 'Total'
+    data.iloc[:, 5] = [f"{value}%" for value in rng.integers(0, 100, rows)]
+
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        texts, face_colors, font_colors = compute_cell_styles(data, 0)
+    style_time = (time.perf_counter() - start_time) / repeats
+
+    fig = matplotlib.figure.Figure(figsize=(12, 6))
+    ax = fig.add_subplot()
+    start_time = time.perf_counter()
+    table = Table(ax, bbox=[0, 0, 1, 1])
+    for i in range(rows):
+        for j in range(cols):
+            table.add_cell(i, j, 1.0 / cols, 1.0 / rows, text=texts[i, j], facecolor=face_colors[i, j],
+                           edgecolor='#444444', loc='center')
+            table[(i, j)]._text.set_color(font_colors[i, j])
+    ax.add_table(table)
+    draw_time = time.perf_counter() - start_time
+
+    print(f"Styling a {rows}x{cols} sheet: {style_time * 1000:.2f} ms, adding its cells: {draw_time * 1000:.2f} ms")
+    return style_time, draw_time
+
+
+def dedupe_columns(columns):
+    """Rename repeated headers the way pd.read_excel does: 'OI', 'OI.1', 'OI.2'."""
+    seen = {}
+    result = []
+    for column in columns:
+        name = column
+        while name in seen:
+            seen[column] += 1
+            name = f"{column}.{seen[column]}"
+        seen[name] = 0
+        result.append(name)
+    return result
+
+
+def normalize_frames(frames):
+    """
+    Give in-memory sheets the values pd.read_excel would return after an xlsx round trip:
+    blank cells become NaN, duplicate headers are suffixed and all-numeric text columns become numbers.
+    """
+    normalized = {}
+    for sheet_name, data in frames.items():
+        data = data.replace('', None).copy()
+        data.columns = dedupe_columns(data.columns)
+        for column in data.columns:
+            values = data[column]
+            numbers = pd.to_numeric(values, errors='coerce')
+            if numbers.notna().sum() == values.notna().sum() and values.notna().any():
+                data[column] = numbers
+        normalized[sheet_name] = data
+    return normalized
+
+
+def read_whole_workbook(excel_file):
+    return pd.read_excel(excel_file, sheet_name=None, engine='openpyxl')
+
+
+def sheet_head_frame(worksheet, max_rows):
+    """The header and first max_rows rows of a worksheet, as raw cell values."""
+    rows = list(worksheet.iter_rows(max_row=max_rows + 1, values_only=True))
+    if not rows:
+        return pd.DataFrame()
+    width = max(len(row) for row in rows)
+    rows = [tuple(row) + (None,) * (width - len(row)) for row in rows]
+    header = [f"Unnamed: {i}" if value is None else value for i, value in enumerate(rows[0])]
+    return pd.DataFrame(rows[1:], columns=header)
+
+
+def formatted_time(value):
+    """A single Time cell formatted the way format_time_column formats the column, so both time gates agree."""
+    return format_time_column(pd.Series([value], dtype=object)).iloc[0]
+
+
+def head_rows_match_time(worksheets, current_time):
+    """The time gate on raw cell values: only the header and first two rows of sheets 1-3 are read."""
+    for worksheet in worksheets[1:4]:
+        rows = list(worksheet.iter_rows(max_row=3, values_only=True))
+        if len(rows) < 3 or 'Time' not in rows[0]:
+            continue
+        time_column_index = rows[0].index('Time')
+        first_row, second_row = rows[1], rows[2]
+        if all(value is None or value == '' for value in first_row) and time_column_index < len(second_row):
+            if formatted_time(second_row[time_column_index]) == current_time:
+                return True
+    return False
+
+
+def load_workbook_head(excel_file, max_rows=20, current_time=None):
+    """
+    The first max_rows rows of every sheet, with the values pd.read_excel(...).head(max_rows) gives
+    (see normalize_frames). The workbook is streamed read-only, so later rows are never parsed.
+
+    :param current_time: If given, only the first two rows of sheets 1-3 are read first, and {} is returned without
+                         loading anything else when none of them passes the time gate.
+    """
+    workbook = openpyxl.load_workbook(excel_file, read_only=True, data_only=True)
     try:
-        # Retry mechanism
-        max_retries = 5
-        for attempt in range(max_retries):
-            try:
-                df = pd.read_excel(excel_file, sheet_name=None, engine='openpyxl')
-                break  # If successful, break out of the retry loop
-            except PermissionError as e:
-                if attempt < max_retries - 1:
-                    print(f"PermissionError: {e}. Retrying in 5 seconds...")
-                    time.sleep(5)  # Wait for 5 seconds before retrying
-                else:
-                    print(f"Failed to read {excel_file} after {max_retries} attempts.")
-                    return
-            except OSError as e:
-                if "used by another process" in str(e):
-                    print(f"File is being used by another process. Retrying in 5 seconds...")
-                    time.sleep(5)  # Wait for 5 seconds before retrying
-                else:
-                    print(f"Error reading {excel_file}: {e}")
-                    os.remove(excel_file)
-                    return
-            except Exception as e:
+        worksheets = workbook.worksheets
+        if current_time is not None and len(worksheets) > 3 and not head_rows_match_time(worksheets, current_time):
+            return {}
+        return normalize_frames({worksheet.title: sheet_head_frame(worksheet, max_rows) for worksheet in worksheets})
+    finally:
+        workbook.close()
+
+
+def read_workbook(excel_file, reader=read_whole_workbook):
+    """Read excel_file with reader, retrying while another process holds it. Returns None on failure."""
+    max_retries = 5
+    for attempt in range(max_retries):
+        try:
+            return reader(excel_file)
+        except PermissionError as e:
+            if attempt < max_retries - 1:
+                print(f"PermissionError: {e}. Retrying in 5 seconds...")
+                time.sleep(5)  # Wait for 5 seconds before retrying
+            else:
+                print(f"Failed to read {excel_file} after {max_retries} attempts.")
+                return None
+        except OSError as e:
+            if "used by another process" in str(e):
+                print(f"File is being used by another process. Retrying in 5 seconds...")
+                time.sleep(5)  # Wait for 5 seconds before retrying
+            else:
                 print(f"Error reading {excel_file}: {e}")
                 os.remove(excel_file)
-                return
-            
-    
-        # Check if the number of sheets is less than the minimum required
-        if len(df) <= 3:
+                return None
+        except Exception as e:
+            print(f"Error reading {excel_file}: {e}")
             os.remove(excel_file)
-            print(f"{excel_file} has fewer than 3 sheets. Skipping conversion.")
-            return
-        if not df:
-            print(f"{excel_file} is empty.")
-            return
+            return None
+    return None
 
 
-        # Check "Time" column in sheets 2, 3, 4
-        current_time = get_current_time_formatted()
-        time_match_found = False
+def read_workbook_fingerprint(excel_file):
+    """The fingerprint database_trial_main stored in the workbook keywords, or None. Only docProps/core.xml is read."""
+    try:
+        with zipfile.ZipFile(excel_file) as archive:
+            core = archive.read('docProps/core.xml').decode('utf-8')
+    except (OSError, KeyError, zipfile.BadZipFile):
+        return None
+    match = re.search(r'<cp:keywords>' + FINGERPRINT_PREFIX + r'([0-9a-f]+)</cp:keywords>', core)
+    return match.group(1) if match else None
 
-        for sheet_index in [1, 2, 3]:
-            if sheet_index >= len(df):
-                continue
-            
-            sheet_name, data = list(df.items())[sheet_index]
-            
-            if "Time" not in data.columns:
-                continue
-            
-            print(f"Processing sheet: {sheet_name}")
-
-             # Convert rows 3 through 8 in the "Time" column to formatted time
-            time_column_index = data.columns.get_loc('Time')
-            for i in range(2, 20):  # Rows 3 to 8 (index 2 to 7)
-                if i < len(data):
-                    data.iloc[i, time_column_index] = format_time(data.iloc[i, time_column_index])
-
-
-            # Check if first row is empty and only process the second row if so
-            if pd.isna(data.iloc[0]).all():
-                if len(data) > 1:
-                    second_row_time = data['Time'].iloc[1]  # Get the time value from the second row
-                    formatted_time = format_time(second_row_time)
-                    
-                    print(f"Second row time value: {second_row_time}, Formatted time: {formatted_time}")
-                    
-                    if formatted_time == current_time:
-                        time_match_found = True
-                        break
-            else:
-                print(f"Sheet {sheet_name} has data in the first row. Skipping...")
-                continue
-        
-        if not time_match_found:
-            os.remove(excel_file)
-            print(f"No matching time found in {excel_file}. Removed file.")
-            return
 
+class FingerprintGate:
+    """Last fingerprint each instrument passed a stage with. Repeats are counted and should be skipped."""
 
-        num_sheets = len(df)
-        max_cols = max(len(data.columns) for data in df.values())
-        max_rows = min(max(len(data) for data in df.values()), 20)
+    def __init__(self, stage):
+        self.stage = stage
+        self.fingerprints = {}
+        self.skipped = 0
 
-        fig_width = max(12, 1 + 0.2 * max_cols)
-        fig_height = 4 * num_sheets + 0.3 * max_rows+2
+    def is_repeat(self, key, fingerprint):
+        if fingerprint is not None and self.fingerprints.get(key) == fingerprint:
+            self.skipped += 1
+            return True
+        return False
 
-        fig, axs = plt.subplots(num_sheets, 1, figsize=(fig_width, fig_height))
-        if num_sheets == 1:
-            axs = [axs]
+    def update(self, key, fingerprint):
+        if fingerprint is not None:
+            self.fingerprints[key] = fingerprint
 
-        fig.patch.set_facecolor('black')
+    def summarize(self):
+        print(f"{self.stage}: {self.skipped} unchanged inputs skipped")
 
-        # Adjust figure layout to add space at the top
-        fig.subplots_adjust(top=1.00)  # Increase the top margin
 
-        for sheet_index, (ax, (sheet_name, data)) in enumerate(zip(axs, df.items())):
-            ax.axis('off')
+def remove_workbook(excel_file, signature=None):
+    """
+    Remove a converted workbook. With a (size, mtime_ns) signature, a file that changed since (a newer version
+    written while this one was rendering) is left for the next render.
+    """
+    try:
+        if signature is not None:
+            stat = os.stat(excel_file)
+            if (stat.st_size, stat.st_mtime_ns) != signature:
+                print(f"{excel_file} changed while it was being converted; keeping the new version.")
+                return
+        os.remove(excel_file)
+    except FileNotFoundError:
+        pass
 
-            # Clean the first sheet name
-            if sheet_index == 0:
-                sheet_name = clean_sheet_name(sheet_name)
 
-            # Check if the sheet contains any data
-            if data.empty:
-                print(f"Sheet {sheet_name} has no data. Skipping...")
-                continue
+@metrics.timed('render.workbook')
+def excel_to_table_image(excel_file, output_dir, fingerprint=None, signature=None):
+    """
+    Render a workbook to an image in output_dir and remove the workbook.
 
-            # Determine the background color for the title based on the sheet name
-            if "3 Min" in sheet_name or "5 Min" in sheet_name or "15 Min" in sheet_name:
-                title_bg_color = '#FFA500' if "3 Min" in sheet_name else '#008000' if "5 Min" in sheet_name else '#0000FF'
-                title_font_color = 'black'
-                title_font_size = 25
-            else:
-                title_bg_color = 'black'
-                title_font_color = '#ffffff'
-                title_font_size = 14
+    :param fingerprint: The workbook's fingerprint, written into the image metadata; read from the workbook if None.
+    :param signature: (size, mtime_ns) of the version to convert; the workbook is only removed if it still matches.
+    :return: The image path, or None if no image was written.
+    """
+    image_file = image_path(output_dir, os.path.splitext(os.path.basename(excel_file))[0])
+    # The previous image stays until a new one replaces it (encode_image moves it into place), so a render that
+    # writes nothing (time mismatch, no changed cells, an error) leaves the last image instead of none
 
-            ax.add_patch(Rectangle((0, 1.02), 1, 0.1, transform=ax.transAxes, color=title_bg_color, zorder=1, clip_on=False))
+    with metrics.timer('render.read'):
+        if SELECTIVE_LOAD:
+            df = read_workbook(excel_file, lambda path: load_workbook_head(path, current_time=get_current_time_formatted()))
+        else:
+            df = read_workbook(excel_file)
+    if df is None:
+        return
+    if not df:
+        # The cheap path: the time gate failed on the first rows and nothing else was loaded
+        print(f"No matching time found in {excel_file}. Skipping conversion.")
+        metrics.count('render.time_mismatch')
+        remove_workbook(excel_file, signature)
+        return None
+    if fingerprint is None:
+        fingerprint = read_workbook_fingerprint(excel_file)
+
+    saved_image = None
+    try:
+        saved_image = frames_to_table_image(df, image_file, excel_file, fingerprint=fingerprint)
+        if saved_image:
+            print(f"Saved image for {excel_file} to {image_file}")
+        remove_workbook(excel_file, signature)
+    except Exception as e:
+        print(f"Error processing {excel_file}: {e}")
+        metrics.count('render.errors')
 
-            if sheet_index == 0:
-                ax.text(0.05, 1.05, sheet_name, fontsize=title_font_size, fontweight='bold', color=title_font_color, ha='left', va='bottom',
-                        bbox=dict(facecolor=title_bg_color, edgecolor='none', boxstyle='round,pad=0'))
-                ax.text(0.5, 1.00, "USE DATA AFTER 10:30 AM", fontsize=12, fontweight='bold', color='yellow', ha='center', va='bottom',
-                        bbox=dict(facecolor='black', edgecolor='none', boxstyle='round,pad=0'))
-            else:
-                ax.text(0.5, 1.02, sheet_name, fontsize=title_font_size, fontweight='bold', color=title_font_color, ha='center', va='bottom',
-                        bbox=dict(facecolor=title_bg_color, edgecolor='none', boxstyle='round,pad=0'))
+    return saved_image
+
+
+def frames_to_table_image(df, image_file, source_name, backend=None, fingerprint=None):
+    """
+    Render a workbook's sheets (as returned by pd.read_excel(sheet_name=None)) to image_file.
+
+    :param df: Ordered mapping of sheet name to DataFrame.
+    :param image_file: Path of the image to write, or a binary file object to write it to.
+    :param source_name: Name used in log messages (the workbook path or instrument).
+    :param backend: 'matplotlib', 'pil' or 'incremental'; defaults to RENDER_BACKEND.
+    :param fingerprint: Workbook fingerprint to store in the image metadata, if any.
+    :return: image_file if an image was saved, None if the sheets were discarded.
+    """
+    # Check if the number of sheets is less than the minimum required
+    if len(df) <= 3:
+        print(f"{source_name} has fewer than 3 sheets. Skipping conversion.")
+        return None
+    if not df:
+        print(f"{source_name} is empty.")
+        return None
+
+
+    # Check "Time" column in sheets 2, 3, 4: a sheet matches when its first row is empty
+    # and its second row holds the current minute
+    current_time = get_current_time_formatted()
+    time_columns = format_time_columns(df)
+    checked, match = time_gate(df, time_columns, current_time)
+    print(f"Second row times: {[time_columns[i].iloc[1] for i in checked if len(time_columns[i]) > 1]}, "
+          f"current time: {current_time}")
+
+    if match is None:
+        print(f"No matching time found in {source_name}. Skipping conversion.")
+        metrics.count('render.time_mismatch')
+        return None
+
+    with metrics.timer('render.style'):
+        # Rows 3 to 20 of the Time column are shown formatted on every sheet checked up to the matching one
+        sheets = list(df.values())
+        for sheet_index in checked[:match + 1]:
+            set_time_rows(sheets[sheet_index], time_columns[sheet_index], slice(2, 20))
+
+        prepared = prepare_sheets(df, time_columns)
+    backend = backend or RENDER_BACKEND
+    if backend == 'incremental':
+        # Keyed by source, the name callers pin to one render process (see PinnedExecutor)
+        return incremental_renderer.render(source_name, prepared, figure_size(df), image_file, fingerprint)
+    if backend == 'pil':
+        return draw_sheets_pil(prepared, figure_size(df), image_file, fingerprint=fingerprint)
+    return draw_sheets_matplotlib(prepared, figure_size(df), image_file, source_name, fingerprint)
+
+
+def render_sheets(sheet_name, sheets, fingerprint=None):
+    """
+    Render scraped sheets (named as in the workbook) to image bytes for pipeline_main; runs in a render process,
+    which only has to import this module. Returns None when the sheets were discarded.
+    """
+    image = io.BytesIO()
+    if frames_to_table_image(normalize_frames(sheets), image, sheet_name, fingerprint=fingerprint) is None:
+        return None
+    return image.getvalue()
 
-            data = data.head(20)
-            
 
+def figure_size(df):
+    """Figure width and height in inches for a workbook."""
+    num_sheets = len(df)
+    max_cols = max(len(data.columns) for data in df.values())
+    max_rows = min(max(len(data) for data in df.values()), 20)
 
-            if sheet_index in [1, 2, 3] and 'Time' in data.columns:
-                if len(data) > 1:
-                    time_column_index = data.columns.get_loc('Time')
-                    # Convert only the second row's time value to formatted time
-                    data.iloc[1, time_column_index] = format_time(data.iloc[1, time_column_index])
+    fig_width = max(12, 1 + 0.2 * max_cols)
+    fig_height = 4 * num_sheets + 0.3 * max_rows+2
+    return fig_width, fig_height
 
-            table = Table(ax, bbox=[0, 0, 1, 1])
-            nrows, ncols = data.shape
-            if ncols == 0 or nrows == 0:
-                print(f"Sheet {sheet_name} in {excel_file} has no data.")
+
+def title_style(sheet_name):
+    """Background color, font color and font size of a sheet's title bar."""
+    if "3 Min" in sheet_name or "5 Min" in sheet_name or "15 Min" in sheet_name:
+        title_bg_color = '#FFA500' if "3 Min" in sheet_name else '#008000' if "5 Min" in sheet_name else '#0000FF'
+        return title_bg_color, 'black', 25
+    return 'black', '#ffffff', 14
+
+
+PreparedSheet = namedtuple('PreparedSheet', ['title', 'title_bg_color', 'title_font_color', 'title_font_size',
+                                             'columns', 'texts', 'face_colors', 'font_colors'])
+
+
+def prepare_sheets(df, time_columns=None):
+    """
+    Title and cell styles of every sheet, shared by both drawing backends. Sheets without data are None.
+
+    :param time_columns: format_time_columns(df), if the caller already has it.
+    """
+    if time_columns is None:
+        time_columns = format_time_columns(df)
+    prepared = []
+    for sheet_index, (sheet_name, data) in enumerate(df.items()):
+        # Clean the first sheet name
+        if sheet_index == 0:
+            sheet_name = clean_sheet_name(sheet_name)
+
+        # Check if the sheet contains any data
+        if data.empty:
+            print(f"Sheet {sheet_name} has no data. Skipping...")
+            prepared.append(None)
+            continue
+
+        data = data.head(20).copy()
+
+        if sheet_index in time_columns and len(data) > 1:
+            # Convert only the second row's time value to formatted time
+            set_time_rows(data, time_columns[sheet_index], [1])
+
+        texts, face_colors, font_colors = compute_cell_styles(data, sheet_index)
+        prepared.append(PreparedSheet(sheet_name, *title_style(sheet_name), [str(column) for column in data.columns],
+                                      texts, face_colors, font_colors))
+    return prepared
+
+
+def image_path(output_dir, name, image_format=None):
+    """Path of the image for name, with the extension of the output format."""
+    return os.path.join(output_dir, f"{name}{IMAGE_EXTENSIONS[image_format or OUTPUT_FORMAT]}")
+
+
+def fingerprint_metadata(image_format, fingerprint):
+    """Save options that store the fingerprint: a PNG text chunk, a JPEG comment or an EXIF description for WebP."""
+    if not fingerprint:
+        return {}
+    text = FINGERPRINT_PREFIX + fingerprint
+    if image_format == 'PNG':
+        pnginfo = PngInfo()
+        pnginfo.add_text('Comment', text)
+        return {'pnginfo': pnginfo}
+    if image_format == 'JPEG':
+        return {'comment': text}
+    exif = Image.Exif()
+    exif[EXIF_IMAGE_DESCRIPTION] = text
+    return {'exif': exif.tobytes()}
+
+
+def encode_image_bytes(image, image_format, dpi, quality, metadata):
+    buffer = io.BytesIO()
+    if image_format == 'PNG':
+        image.save(buffer, 'PNG', dpi=(dpi, dpi), compress_level=PNG_COMPRESS_LEVEL, **metadata)
+    else:
+        image.save(buffer, image_format, dpi=(dpi, dpi), quality=quality, **metadata)
+    return buffer.getvalue()
+
+
+@metrics.timed('render.encode')
+def encode_image(image, image_file, dpi, image_format=None, quality=None, max_bytes=None, fingerprint=None):
+    """
+    Encode a rendered canvas once and write it to image_file, a path or a binary file object.
+
+    JPEG drops the alpha channel (as the poster used to when it re-saved images). When the result is larger than
+    max_bytes, JPEG and WebP quality is lowered down to MIN_OUTPUT_QUALITY first, then the image is scaled down.
+    The file is written under a temporary name and moved into place, so a watcher never sees a partial image.
+    A workbook fingerprint, if given, goes into the image metadata for the poster.
+
+    :return: image_file
+    """
+    image_format = image_format or OUTPUT_FORMAT
+    quality = quality or OUTPUT_QUALITY
+    max_bytes = max_bytes or MAX_OUTPUT_BYTES
+    if image_format == 'JPEG':
+        image = image.convert('RGB')
+    metadata = fingerprint_metadata(image_format, fingerprint)
+
+    data = encode_image_bytes(image, image_format, dpi, quality, metadata)
+    while len(data) > max_bytes and min(image.size) > 100:
+        if image_format != 'PNG' and quality > MIN_OUTPUT_QUALITY:
+            quality = max(quality - 10, MIN_OUTPUT_QUALITY)
+        else:
+            image = image.resize((int(image.width * 0.8), int(image.height * 0.8)), Image.LANCZOS)
+            dpi = dpi * 0.8
+        data = encode_image_bytes(image, image_format, dpi, quality, metadata)
+
+    if hasattr(image_file, 'write'):
+        image_file.write(data)
+        return image_file
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(image_file) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, image_file)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return image_file
+
+
+class TableFigureTemplate:
+    """
+    A matplotlib Figure (Agg canvas, no pyplot) laid out for one sheet count and set of table shapes. Titles, cells
+    and the watermark are created once; each render only updates texts and colors before saving.
+    """
+
+    def __init__(self, size, shapes):
+        self.figure = matplotlib.figure.Figure(figsize=size)
+        FigureCanvasAgg(self.figure)
+        axs = self.figure.subplots(len(shapes), 1, squeeze=False)[:, 0]
+
+        self.figure.patch.set_facecolor('black')
+
+        # Adjust figure layout to add space at the top
+        self.figure.subplots_adjust(top=1.00)  # Increase the top margin
+
+        self.sheets = []
+        for sheet_index, (ax, shape) in enumerate(zip(axs, shapes)):
+            ax.axis('off')
+            if shape is None:
+                self.sheets.append(None)
                 continue
 
+            title_bar = Rectangle((0, 1.02), 1, 0.1, transform=ax.transAxes, zorder=1, clip_on=False)
+            ax.add_patch(title_bar)
+
+            if sheet_index == 0:
+                title = ax.text(0.05, 1.05, '', fontweight='bold', ha='left', va='bottom')
+                ax.text(0.5, 1.00, BANNER_TEXT, fontsize=12, fontweight='bold', color='yellow', ha='center', va='bottom',
+                        bbox=dict(facecolor='black', edgecolor='none', boxstyle='round,pad=0'))
+            else:
+                title = ax.text(0.5, 1.02, '', fontweight='bold', ha='center', va='bottom')
+
+            table = Table(ax, bbox=[0, 0, 1, 1])
+            nrows, ncols = shape
+
             width = 1.0 / ncols
             height = 1.0 / (nrows + 1)
 
-            header_color = '#333333'
-            header_font_color = '#ffffff'
-
-            for i, column in enumerate(data.columns):
-                table.add_cell(0, i, width, height, text=column, facecolor=header_color,
-                            edgecolor='#444444', loc='center')
-                cell = table[(0, i)]
-                cell._text.set_fontsize(10)
-                cell._text.set_color(header_font_color)
+            for j in range(ncols):
+                table.add_cell(0, j, width, height, text='', facecolor=HEADER_COLOR, edgecolor=GRID_COLOR, loc='center')
+                cell = table[(0, j)]
+                cell._text.set_color(HEADER_FONT_COLOR)
                 cell._text.set_weight('bold')
+            for i in range(nrows):
+                for j in range(ncols):
+                    table.add_cell(i + 1, j, width, height, text='', edgecolor=GRID_COLOR, loc='center')
+
+            ax.add_table(table)
+            # Drawing rescales the cells into the table's bbox; keep the layout so each render starts from it
+            layout = {key: (cell.get_xy(), cell.get_width(), cell.get_height()) for key, cell in table.get_celld().items()}
+            self.sheets.append((title_bar, title, table, layout))
 
-            # Initialize median_row_index
-            median_row_index = None
-
-            # Clean and process the 5th column for median calculation
-            if sheet_index == 0 and ncols > 5:
-                # Remove percentage signs and convert to numeric
-                data.iloc[:, 5] = data.iloc[:, 5].astype(str).str.replace('%', '', regex=False).replace('-', '', regex=False)
-                data.iloc[:, 5] = pd.to_numeric(data.iloc[:, 5], errors='coerce')
-                median_value = data.iloc[:, 5].median()
-                median_row = data[data.iloc[:, 5] == median_value].index.tolist()
-
-                if median_row:
-                    median_row_index = median_row[0]
-
-            # Find maximum values for specified columns
-            max_values = {}
-            if sheet_index == 0 and ncols > 1:
-                if len(data.columns) > 7:
-                    max_values[1] = data.iloc[:, 1].max()
-                    max_values[7] = data.iloc[:, 7].max()
-
-
-
-            # Add Data Rows
-            for i, row in enumerate(data.values):
-                for j, cell_value in enumerate(row):
-                    font_color = '#cccccc'  # Default light gray font color
-
-                    # Alternate background colors for rows
-                    if i % 2 == 0:
-                        bg_color = 'black'  # Black background color for even rows
-                    else:
-                        bg_color = '#333333'  # Gray background color for odd rows
-
-                    if 'Total' in str(cell_value) and sheet_index == 0:
-                        if j in [5, 6, 7, 8]:
-                            font_color = '#FFFF00'  # Yellow font color
-                        bg_color = '#FFFF00'  # Yellow background color for the "Total" row
-                        font_color = '#000000'  # Black font color for the "Total" row
-                        # Set font color for the entire row to yellow
-                        for k in range(len(row)):
-                            try:
-                                table[(i + 1, k)]._text.set_color('#FFFF00')
-                            except KeyError:
-                                pass  # Skip if the cell does not exist
-
-                    # Determine font color based on specific conditions
-                    if sheet_index == 0:
-                        # First sheet: Green font color for columns 2 and 6, red for negative numbers
-                        if j == 2 or j == 6:
-                            if isinstance(cell_value, (int, float)) and cell_value < 0:
-                                font_color = '#ff0000'  # Red font color for negative numbers
-                            else:
-                                font_color = '#00ff00'  # Green font color
-                    else:
-                        # Other sheets: Green font color for columns 3, 4, 5, and 8, red for negative numbers
-                        if j in [3, 4, 5, 8]:
-                            if isinstance(cell_value, (int, float)) and cell_value < 0:
-                                font_color = '#ff0000'  # Red font color for negative numbers
-                            else:
-                                font_color = '#00ff00'  # Green font color
-
-                    # Handle empty cells
-                    if pd.isna(cell_value):
-                        cell_value = ''  # Keep the cell empty
-
-                    # Highlight "sell" keyword in non-first sheets
-                    if sheet_index != 0 and (j == 5 or j == 8) and isinstance(cell_value, str) and 'sell' in cell_value.lower() and 'SELL' in cell_value.upper():
-                        font_color = '#ff0000'  # Red font color
-
-                    # Highlight the corresponding value in the 4th column of the row with the median percentage value
-                    if sheet_index == 0 and median_row_index is not None and i == median_row_index and j == 4:
-                        bg_color = '#FFFF00'  # Yellow background color
-                        font_color = '#000000'  # Black font color
-
-                    # Highlight the maximum values in specified columns
-                    if sheet_index == 0 and j in max_values:
-                        if cell_value == max_values[j]:
-                            font_color = '#FFFF00'  # Yellow background color
-
-                    table.add_cell(i + 1, j, width, height, text=str(cell_value),
-                                facecolor=bg_color, edgecolor='#444444', loc='center')
+        add_watermark(axs[-1], WATERMARK_TEXT, fontsize=90, opacity=0.5)
 
+    def render(self, prepared, image_file, fingerprint=None):
+        with metrics.timer('render.draw'):
+            image = self.draw(prepared)
+        return encode_image(image, image_file, OUTPUT_DPI, fingerprint=fingerprint)
+
+    def draw(self, prepared):
+        """Update the figure for the prepared sheets and return it drawn as an RGBA image."""
+        for sheet, parts in zip(prepared, self.sheets):
+            if sheet is None:
+                continue
+            title_bar, title, table, layout = parts
+            for key, (xy, width, height) in layout.items():
+                cell = table[key]
+                cell.set_xy(xy)
+                cell.set_width(width)
+                cell.set_height(height)
+
+            title_bar.set_color(sheet.title_bg_color)
+            title.set_text(sheet.title)
+            title.set_fontsize(sheet.title_font_size)
+            title.set_color(sheet.title_font_color)
+            title.set_bbox(dict(facecolor=sheet.title_bg_color, edgecolor='none', boxstyle='round,pad=0'))
+
+            # The table shrank its font to fit the last texts; start every render from size 10 again
+            for j, column in enumerate(sheet.columns):
+                cell = table[(0, j)]
+                cell._text.set_text(column)
+                cell.set_fontsize(10)
+
+            nrows, ncols = sheet.texts.shape
+            for i in range(nrows):
+                for j in range(ncols):
                     cell = table[(i + 1, j)]
-                    cell._text.set_fontsize(10)
-                    cell._text.set_color(font_color)
+                    cell._text.set_text(sheet.texts[i, j])
+                    cell._text.set_color(sheet.font_colors[i, j])
+                    cell.set_facecolor(sheet.face_colors[i, j])
+                    cell.set_fontsize(10)
 
-            ax.add_table(table)
+        # Render straight into a raw RGBA buffer and leave the one encode to encode_image
+        buffer = io.BytesIO()
+        self.figure.savefig(buffer, format='rgba', bbox_inches='tight', pad_inches=0.1, dpi=OUTPUT_DPI, transparent=True)
+        renderer = self.figure.canvas.renderer  # The renderer savefig just drew with, sized to the tight bbox
+        return Image.frombuffer('RGBA', (int(renderer.width), int(renderer.height)), buffer.getbuffer(), 'raw', 'RGBA', 0, 1)
 
-        add_watermark(ax, "Sample Data", fontsize=90, opacity=0.5)
 
-    # Save the figure only if there are any valid sheets
-        if any(ax.get_children() for ax in axs):
-            plt.savefig(image_file, bbox_inches='tight', pad_inches=0.1, dpi=300, transparent=True)
-            print(f"Saved image for {excel_file} to {image_file}")
-            os.remove(excel_file)
+figure_templates = OrderedDict()  # (size, table shapes) -> TableFigureTemplate, least recently used first
+figure_templates_lock = threading.Lock()
+
+
+def draw_sheets_matplotlib(prepared, size, image_file, source_name, fingerprint=None):
+    if all(sheet is None for sheet in prepared):
+        print(f"No valid sheets with data to save for {source_name}. Removing empty image file if exists.")
+        if isinstance(image_file, str) and os.path.exists(image_file):
+            os.remove(image_file)
+        return None
+
+    key = (tuple(size), tuple(None if sheet is None else sheet.texts.shape for sheet in prepared))
+    with figure_templates_lock:
+        template = figure_templates.pop(key, None)
+        if template is None:
+            template = TableFigureTemplate(size, key[1])
+        figure_templates[key] = template
+        while len(figure_templates) > TEMPLATE_CACHE_SIZE:
+            figure_templates.popitem(last=False)
+        return template.render(prepared, image_file, fingerprint)
+
+
+@lru_cache(maxsize=32)
+def pil_font(size_px, bold=False):
+    """DejaVu Sans (the font matplotlib draws with) at a pixel size, loaded once per size."""
+    path = font_manager.findfont(font_manager.FontProperties(family='DejaVu Sans', weight='bold' if bold else 'normal'))
+    return ImageFont.truetype(path, size_px)
+
+
+@lru_cache(maxsize=32)
+def pil_grid_geometry(size, shapes, dpi):
+    """
+    Pixel geometry of the figure, matching Figure.subplots with matplotlib's default subplot parameters and top=1.
+
+    :param size: Figure (width, height) in inches.
+    :param shapes: (rows, columns) of each sheet's table, header row included; None for sheets without data.
+    :return: (canvas width, canvas height, [(axes box, x edges, y edges) per sheet]) with y measured from the top.
+    """
+    width, height = round(size[0] * dpi), round(size[1] * dpi)
+    left, right, bottom, top, hspace = 0.125, 0.9, 0.11, 1.0, 0.2
+    num_sheets = len(shapes)
+    axes_height = (top - bottom) / (num_sheets + hspace * (num_sheets - 1))
+
+    # The first title bar sits above the figure's top edge (matplotlib keeps it through bbox_inches='tight'),
+    # so the canvas gets extra room above the figure
+    margin = round(0.2 * axes_height * height)
+
+    grids = []
+    for sheet_index, shape in enumerate(shapes):
+        axes_top = margin + (1 - top + sheet_index * axes_height * (1 + hspace)) * height
+        axes_box = (left * width, axes_top, right * width, axes_top + axes_height * height)
+        if shape is None:
+            grids.append((axes_box, None, None))
+            continue
+        nrows, ncols = shape
+        x_edges = np.linspace(axes_box[0], axes_box[2], ncols + 1)
+        y_edges = np.linspace(axes_box[1], axes_box[3], nrows + 1)
+        grids.append((axes_box, x_edges, y_edges))
+    return width, height + margin, grids
+
+
+def fitted_font_size(texts, bold, cell_width, dpi, max_points=10):
+    """Largest point size (like Table's auto font size) at which every text fits in 80% of the cell width."""
+    widest = max(texts, key=len, default='')
+    points = max_points
+    while points > 1 and pil_font(round(points * dpi / 72), bold).getlength(widest) > 0.8 * cell_width:
+        points -= 1
+    return points
+
+
+def draw_pil_text_box(draw, xy, text, font, fill, box_fill, anchor):
+    box = draw.textbbox(xy, text, font=font, anchor=anchor)
+    draw.rectangle(box, fill=box_fill)
+    draw.text(xy, text, font=font, fill=fill, anchor=anchor)
+
+
+PilSheetLayout = namedtuple('PilSheetLayout', ['axes_box', 'x_edges', 'y_edges', 'header_font', 'body_font'])
+
+
+def pil_layout(prepared, size, dpi):
+    """Canvas size plus the grid and fonts of every sheet (None for sheets without data)."""
+    shapes = tuple(None if sheet is None else (sheet.texts.shape[0] + 1, sheet.texts.shape[1]) for sheet in prepared)
+    width, height, grids = pil_grid_geometry(tuple(size), shapes, dpi)
+
+    layouts = []
+    for sheet, (axes_box, x_edges, y_edges) in zip(prepared, grids):
+        if sheet is None:
+            layouts.append(None)
+            continue
+        cell_width = x_edges[1] - x_edges[0]
+        header_font = pil_font(round(fitted_font_size(sheet.columns, True, cell_width, dpi) * dpi / 72), bold=True)
+        body_font = pil_font(round(fitted_font_size(sheet.texts.ravel().tolist(), False, cell_width, dpi) * dpi / 72))
+        # matplotlib's Table shrinks every cell to the smallest size any cell needs
+        if body_font.size < header_font.size:
+            header_font = pil_font(body_font.size, bold=True)
         else:
-            print(f"No valid sheets with data to save for {excel_file}. Removing empty image file if exists.")
-            if os.path.exists(image_file):
-                os.remove(image_file)
-    except Exception as e:
-        print(f"Error processing {excel_file}: {e}")
+            body_font = pil_font(header_font.size)
+        layouts.append(PilSheetLayout(axes_box, x_edges, y_edges, header_font, body_font))
+    return width, height, layouts
 
-    plt.close()
-    
 
-    end_time = time.time()  #                End timing the processing
-    processing_time = end_time - start_time
+def draw_pil_cell(draw, layout, i, j, text, font, face_color, font_color, dpi):
+    """Draw cell (i, j) of a table; row 0 is the header."""
+    box = (layout.x_edges[j], layout.y_edges[i], layout.x_edges[j + 1], layout.y_edges[i + 1])
+    draw.rectangle(box, fill=face_color, outline=GRID_COLOR, width=max(1, round(dpi / 72)))
+    draw.text(((box[0] + box[2]) / 2, (box[1] + box[3]) / 2), text, font=font, fill=font_color, anchor='mm')
+
 
-    # Save execution time to the second sheet of the Excel file
-    if len(df) > 1:
-        sheet_2 = list(df.items())[1][1]  # Second sheet data
-        sheet_2_file = os.path.join(output_dir, f"{os.path.splitext(os.path.basename(excel_file))[0]}_sheet_2.xlsx")
-        with pd.ExcelWriter(sheet_2_file, engine='openpyxl') as writer:
-            sheet_2.to_excel(writer, index=False, sheet_name='Sheet2')
-            # Write execution time
-            exec_time_df = pd.DataFrame({'Execution Time': [f"{processing_time:.2f} seconds"]})
-            exec_time_df.to_excel(writer, index=False, startrow=len(sheet_2) + 2, sheet_name='Sheet2')
+def draw_pil_canvas(prepared, size, dpi):
+    """
+    Draw titles and tables (everything but the watermark) on a transparent canvas. Transparent pixels are white,
+    like matplotlib's, so a JPEG (which drops the alpha channel) gets the same white margins from both backends.
+    """
+    width, height, layouts = pil_layout(prepared, size, dpi)
+    canvas = Image.new('RGBA', (width, height), (255, 255, 255, 0))
+    draw = ImageDraw.Draw(canvas)
+
+    for sheet_index, (sheet, layout) in enumerate(zip(prepared, layouts)):
+        if sheet is None:
+            continue
+        axes_left, axes_top, axes_right, axes_bottom = layout.axes_box
+        axes_height = axes_bottom - axes_top
+
+        # Title bar from 1.02 to 1.12 in axes coordinates, i.e. just above the table, plus the half of matplotlib's
+        # 1 pt edge (set_color paints the edge too) that lies outside the rectangle
+        edge = dpi / 144
+        draw.rectangle((axes_left - edge, axes_top - 0.12 * axes_height - edge, axes_right + edge,
+                        axes_top - 0.02 * axes_height + edge), fill=sheet.title_bg_color)
+        title_font = pil_font(round(sheet.title_font_size * dpi / 72), bold=True)
+        if sheet_index == 0:
+            draw_pil_text_box(draw, (axes_left + 0.05 * (axes_right - axes_left), axes_top - 0.05 * axes_height),
+                              sheet.title, title_font, sheet.title_font_color, sheet.title_bg_color, 'ld')
+            draw_pil_text_box(draw, ((axes_left + axes_right) / 2, axes_top), BANNER_TEXT,
+                              pil_font(round(12 * dpi / 72), bold=True), 'yellow', 'black', 'md')
+        else:
+            draw_pil_text_box(draw, ((axes_left + axes_right) / 2, axes_top - 0.02 * axes_height),
+                              sheet.title, title_font, sheet.title_font_color, sheet.title_bg_color, 'md')
 
-    print(f"Processed {excel_file} in {processing_time:.2f} seconds")
+        nrows, ncols = sheet.texts.shape
+        for j in range(ncols):
+            draw_pil_cell(draw, layout, 0, j, sheet.columns[j], layout.header_font, HEADER_COLOR, HEADER_FONT_COLOR, dpi)
+        for i in range(nrows):
+            for j in range(ncols):
+                draw_pil_cell(draw, layout, i + 1, j, sheet.texts[i, j], layout.body_font,
+                              sheet.face_colors[i, j], sheet.font_colors[i, j], dpi)
+    return canvas, layouts
+
+
+def save_pil_canvas(canvas, image_file, dpi, fingerprint=None):
+    """Add the watermark, crop like bbox_inches='tight', pad_inches=0.1 and write the image."""
+    image = Image.alpha_composite(canvas, pil_watermark_layer(canvas.size, dpi))
+    image = image.crop(pil_crop_box(image, dpi))
+    return encode_image(image, image_file, dpi, fingerprint=fingerprint)
 
-    return image_file
+
+def pil_crop_box(image, dpi):
+    left, top, right, bottom = image.getbbox()
+    pad = round(0.1 * dpi)
+    return max(left - pad, 0), max(top - pad, 0), min(right + pad, image.width), min(bottom + pad, image.height)
+
+
+def draw_sheets_pil(prepared, size, image_file, dpi=PIL_DPI, fingerprint=None):
+    """Draw the prepared sheets with Pillow in the same layout as draw_sheets_matplotlib."""
+    with metrics.timer('render.draw'):
+        canvas, _ = draw_pil_canvas(prepared, size, dpi)
+    return save_pil_canvas(canvas, image_file, dpi, fingerprint)
+
+
+class IncrementalRenderer:
+    """
+    Pillow renderer that keeps the last canvas of every instrument. When the layout (figure size, titles, headers,
+    table shapes and fonts) is the same as last time, only cells whose text or colors changed are redrawn, and an
+    instrument with no changed cell produces no image at all.
+
+    The cache lives in the render process, so every version of an instrument has to be rendered by the same
+    process, in order (PinnedExecutor); otherwise a process could compare against a canvas another one replaced.
+    """
+
+    def __init__(self, dpi=PIL_DPI):
+        self.dpi = dpi
+        self.previous = {}  # instrument -> (layout key, canvas, prepared sheets)
+
+    def layout_key(self, prepared, size, layouts):
+        return (tuple(size), tuple(
+            None if sheet is None else (sheet.title, sheet.title_bg_color, sheet.title_font_color,
+                                        sheet.title_font_size, tuple(sheet.columns), sheet.texts.shape,
+                                        layout.header_font.size, layout.body_font.size)
+            for sheet, layout in zip(prepared, layouts)))
+
+    def render(self, instrument, prepared, size, image_file, fingerprint=None):
+        """Write image_file for instrument and return it, or return None when nothing changed since the last call."""
+        _, _, layouts = pil_layout(prepared, size, self.dpi)
+        key = self.layout_key(prepared, size, layouts)
+        previous = self.previous.get(instrument)
+
+        with metrics.timer('render.draw'):
+            if previous is None or previous[0] != key:
+                canvas, _ = draw_pil_canvas(prepared, size, self.dpi)
+            else:
+                _, previous_canvas, previous_sheets = previous
+                canvas = previous_canvas.copy()  # The cached canvas stays what the last written image shows
+                draw = ImageDraw.Draw(canvas)
+                changed_cells = 0
+                for sheet, old_sheet, layout in zip(prepared, previous_sheets, layouts):
+                    if sheet is None:
+                        continue
+                    changed = ((sheet.texts != old_sheet.texts) | (sheet.face_colors != old_sheet.face_colors)
+                               | (sheet.font_colors != old_sheet.font_colors))
+                    for i, j in zip(*np.nonzero(changed)):
+                        draw_pil_cell(draw, layout, i + 1, j, sheet.texts[i, j], layout.body_font,
+                                      sheet.face_colors[i, j], sheet.font_colors[i, j], self.dpi)
+                    changed_cells += int(changed.sum())
+                if changed_cells == 0:
+                    print(f"No cells changed for {instrument}; not writing a new image.")
+                    return None
+                print(f"Redrew {changed_cells} changed cells for {instrument}.")
+
+        saved_image = save_pil_canvas(canvas, image_file, self.dpi, fingerprint)
+        self.previous[instrument] = (key, canvas, prepared)  # Only once the image is written
+        return saved_image
+
+
+incremental_renderer = IncrementalRenderer()
+
+
+@lru_cache(maxsize=8)
+def pil_watermark_layer(size, dpi):
+    """The rotated "Sample Data" watermark at half opacity, centered on a transparent layer of the canvas size."""
+    font = pil_font(round(90 * dpi / 72), bold=True)
+    text_box = font.getbbox(WATERMARK_TEXT)
+    text_layer = Image.new('RGBA', (text_box[2] + 2, text_box[3] + 2), (0, 0, 0, 0))
+    ImageDraw.Draw(text_layer).text((1, 1), WATERMARK_TEXT, font=font, fill=(128, 128, 128, 128))
+    text_layer = text_layer.rotate(45, expand=True, resample=Image.BICUBIC)
+    layer = Image.new('RGBA', size, (0, 0, 0, 0))
+    layer.paste(text_layer, ((size[0] - text_layer.width) // 2, (size[1] - text_layer.height) // 2))
+    return layer
+
+
+LAYOUT_TOLERANCE = 3  # Pixels a title bar edge or grid line may sit apart between the backends (0.25 mm at 300 dpi)
+CELL_TEXT_TOLERANCE = 0.25  # Largest offset of a cell's text center, as a fraction of the cell height
+COLOR_MATCH = 10  # Largest channel difference for a pixel to count as a title bar or grid line color
+
+
+def layout_regions(prepared, size, dpi=PIL_DPI):
+    """
+    Where the title bars, tables and cells are in the saved image's pixels, from the Pillow backend's geometry.
+
+    :return: (kind, label, (left, top, right, bottom), color) per region; kind is 'title bar', 'table' or 'cell'
+        and color is the title bar's color (None for the others).
+    """
+    canvas, layouts = draw_pil_canvas(prepared, size, dpi)
+    crop_left, crop_top, _, _ = pil_crop_box(Image.alpha_composite(canvas, pil_watermark_layer(canvas.size, dpi)), dpi)
+    line = max(1, round(dpi / 72)) + 2  # Grid line width plus antialiasing on either side
+
+    regions = []
+    for sheet, layout in zip(prepared, layouts):
+        if sheet is None:
+            continue
+        axes_left, axes_top, axes_right, axes_bottom = layout.axes_box
+        axes_height = axes_bottom - axes_top
+        x_edges, y_edges = layout.x_edges, layout.y_edges
+        regions.append(('title bar', sheet.title,
+                        (axes_left, axes_top - 0.12 * axes_height, axes_right, axes_top - 0.02 * axes_height),
+                        sheet.title_bg_color))
+        regions.append(('table', sheet.title, (x_edges[0], y_edges[0], x_edges[-1], y_edges[-1]), None))
+        for i in range(len(y_edges) - 1):
+            for j in range(len(x_edges) - 1):
+                regions.append(('cell', f"{sheet.title} cell {i},{j}",
+                                (x_edges[j] + line, y_edges[i] + line, x_edges[j + 1] - line, y_edges[i + 1] - line),
+                                None))
+    return [(kind, label, (round(left - crop_left), round(top - crop_top), round(right - crop_left),
+                           round(bottom - crop_top)), color)
+            for kind, label, (left, top, right, bottom), color in regions]
+
+
+def flatten_image(image):
+    """RGB array of an image flattened onto white, so transparent margins stand apart from black title bars."""
+    image = image.convert('RGBA')
+    return np.asarray(Image.alpha_composite(Image.new('RGBA', image.size, 'white'), image).convert('RGB'),
+                      dtype=np.int16)
+
+
+def color_mask(pixels, color):
+    return np.abs(pixels - np.array(matplotlib.colors.to_rgb(color)) * 255).max(axis=2) <= COLOR_MATCH
+
+
+def color_box(pixels, color):
+    """
+    Box of the rows and columns at least half in one color, or None. Unlike a plain bounding box it leaves out the
+    title text's box and the black banner that touch the first title bar.
+    """
+    mask = color_mask(pixels, color)
+    rows, cols = np.nonzero(mask.mean(axis=1) >= 0.5)[0], np.nonzero(mask.mean(axis=0) >= 0.5)[0]
+    if not len(rows) or not len(cols):
+        return None
+    return np.array([cols.min(), rows.min(), cols.max(), rows.max()])
+
+
+def grid_lines(pixels, axis):
+    """
+    Centers of the grid lines in a table: horizontal lines for axis 0, vertical ones for axis 1. A line is a run of
+    rows (columns) in the grid color across at least a third of the table; the watermark hides the rest of some.
+    """
+    coverage = color_mask(pixels, GRID_COLOR).mean(axis=1 - axis)
+    on_line = np.nonzero(coverage >= 1 / 3)[0]
+    runs = np.split(on_line, np.nonzero(np.diff(on_line) > 1)[0] + 1) if len(on_line) else []
+    return np.array([run.mean() for run in runs])
+
+
+def text_center(pixels):
+    """
+    Center of the pixels far from the region's median color, or None for a region without text. The cutoff
+    follows the strongest contrast in the region, so the half-transparent watermark does not count as text.
+    """
+    distance = np.abs(pixels - np.median(pixels.reshape(-1, 3), axis=0)).max(axis=2)
+    if distance.max() <= 96:
+        return None
+    rows, cols = np.nonzero(distance > 0.6 * distance.max())
+    return (cols.min() + cols.max()) / 2, (rows.min() + rows.max()) / 2
+
+
+def compare_regions(reference, candidate, regions, margin=12):
+    """
+    Check candidate against reference region by region, both as flatten_image arrays.
+
+    Tables compare the positions of their horizontal and vertical grid lines and title bars their edges,
+    within LAYOUT_TOLERANCE pixels once the images' overall offset (tight cropping can differ by a pixel or two)
+    is taken out. Cells compare where their text sits, within CELL_TEXT_TOLERANCE of the cell height, since the
+    two font rasterizers never match pixel for pixel.
+
+    :param margin: Pixels around each region searched, so a shifted line or bar is still found.
+    :return: (kind, label, measure, ok) per region; measure is in pixels for tables and title bars.
+    """
+    def window(pixels, box):
+        left, top, right, bottom = box
+        return pixels[max(top - margin, 0):bottom + margin, max(left - margin, 0):right + margin]
+
+    tables = {}
+    for kind, label, box, _ in regions:
+        if kind == 'table':
+            tables[label] = [(grid_lines(window(reference, box), axis), grid_lines(window(candidate, box), axis))
+                             for axis in (0, 1)]
+    # Overall offset per axis (y, x): the median shift of the grid lines, over every table
+    offsets = [np.median(np.concatenate([expected - actual for lines in tables.values()
+                                         for expected, actual in [lines[axis]] if len(expected) == len(actual)]
+                                        or [np.zeros(1)])) for axis in (0, 1)]
+
+    results = []
+    for kind, label, box, color in regions:
+        if kind == 'table':
+            measure = 0.0
+            for axis, (expected, actual) in enumerate(tables[label]):
+                if len(expected) != len(actual) or not len(expected):
+                    measure = float('inf')
+                    break
+                measure = max(measure, float(np.abs(expected - actual - offsets[axis]).max()))
+            results.append((kind, label, measure, measure <= LAYOUT_TOLERANCE))
+        elif kind == 'title bar':
+            expected, actual = color_box(window(reference, box), color), color_box(window(candidate, box), color)
+            if expected is None or actual is None:
+                measure = float('inf')
+            else:
+                measure = float(np.abs(expected - actual - np.array([offsets[1], offsets[0]] * 2)).max())
+            results.append((kind, label, measure, measure <= LAYOUT_TOLERANCE))
+        else:
+            left, top, right, bottom = box
+            expected = text_center(reference[top:bottom, left:right])
+            actual = text_center(candidate[top:bottom, left:right])
+            if expected is None or actual is None:
+                measure = 0.0 if expected == actual else float('inf')
+            else:
+                measure = max(abs(expected[0] - actual[0]), abs(expected[1] - actual[1])) / (bottom - top)
+            results.append((kind, label, measure, measure <= CELL_TEXT_TOLERANCE))
+    return results
+
+
+def compare_backends(df, output_dir):
+    """
+    Render one workbook with both backends and compare their title bars, grid lines and cell text with
+    compare_regions, taking the matplotlib image as the reference.
+
+    :return: The (kind, label, measure, ok) results of the regions that differ.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    images = {}
+    for backend in ('matplotlib', 'pil'):
+        frames = {sheet_name: data.copy() for sheet_name, data in df.items()}
+        images[backend] = image_path(output_dir, f"backend_{backend}")
+        prepared = prepare_sheets(frames)
+        if backend == 'pil':
+            draw_sheets_pil(prepared, figure_size(frames), images[backend])
+        else:
+            draw_sheets_matplotlib(prepared, figure_size(frames), images[backend], 'compare_backends')
+
+    with Image.open(images['matplotlib']) as reference, Image.open(images['pil']) as candidate:
+        results = compare_regions(flatten_image(reference), flatten_image(candidate),
+                                  layout_regions(prepared, figure_size(frames)))
+
+    mismatches = [result for result in results if not result[3]]
+    for kind in ('title bar', 'table', 'cell'):
+        checked = [result for result in results if result[0] == kind]
+        failed = [label for result_kind, label, _, _ in mismatches if result_kind == kind]
+        print(f"{kind}: {len(checked) - len(failed)}/{len(checked)} regions match"
+              + (f"; differ: {', '.join(failed[:5])}" if failed else ""))
+    return mismatches
 
 
 import pandas as pd
 import os
 
 def convert_to_time_format(cell_value):
+    """HH:MM:SS text to datetime.time. Takes one value or a whole Series; other values are returned unchanged."""
+    if isinstance(cell_value, pd.Series):
+        times = pd.to_datetime(cell_value.astype(str), format='%H:%M:%S', errors='coerce')
+        return times.dt.time.where(times.notna(), cell_value)
     try:
         time_value = pd.to_datetime(cell_value, format='%H:%M:%S').time()
         return time_value
@@ -368,41 +1192,221 @@ def convert_to_time_format(cell_value):
 
 import time
 
-def process_directory_continuously(input_dir, output_dir, run_duration= 5 * 3600, check_interval=10):
+class BoundedSet:
+    """Set that forgets its oldest entries once it holds more than maxlen items."""
+
+    def __init__(self, maxlen):
+        self.maxlen = maxlen
+        self.items = OrderedDict()
+
+    def add(self, item):
+        self.items[item] = None
+        self.items.move_to_end(item)
+        while len(self.items) > self.maxlen:
+            self.items.popitem(last=False)
+
+    def __contains__(self, item):
+        return item in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+
+class WorkbookIntake(FileSystemEventHandler):
+    """
+    Collects .xlsx paths from watchdog events. Every event on a path restarts its debounce, and a path is
+    handed out once its size and mtime are the same on two checks in a row, i.e. the writer has finished.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}  # path -> (size, mtime_ns) at the last check, None right after an event
+        self.busy = set()  # Paths being rendered; a newer version waits in pending until the render is done
+        self.wakeup = threading.Event()
+
+    def add(self, path):
+        name = os.path.basename(path)
+        if not name.endswith('.xlsx') or name.startswith('~$'):
+            return
+        with self.lock:
+            self.pending[path] = None
+        self.wakeup.set()
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.add(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.add(event.src_path)
+
+    def on_closed(self, event):
+        if not event.is_directory:
+            self.add(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.add(event.dest_path)
+
+    def has_pending(self):
+        with self.lock:
+            return any(path not in self.busy for path in self.pending)
+
+    def start(self, path):
+        with self.lock:
+            self.busy.add(path)
+
+    def finish(self, path):
+        with self.lock:
+            self.busy.discard(path)
+            if path in self.pending:
+                self.pending[path] = None  # Check the waiting version afresh
+        self.wakeup.set()
+
+    def ready_files(self):
+        """Return (path, (size, mtime_ns)) for every pending workbook that stopped changing since the last check."""
+        ready = []
+        with self.lock:
+            for path, last_seen in list(self.pending.items()):
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    del self.pending[path]
+                    continue
+                signature = (stat.st_size, stat.st_mtime_ns)
+                if signature == last_seen and stat.st_size > 0 and path not in self.busy:
+                    ready.append((path, signature))
+                    del self.pending[path]
+                else:
+                    self.pending[path] = signature
+        return ready
+
+
+def init_render_worker():
+    """Runs once in each render process: select the Agg backend and load the fonts before the first workbook."""
+    matplotlib.use('Agg')
+    from matplotlib import font_manager
+    font_manager.findfont(font_manager.FontProperties(family='DejaVu Sans', weight='bold'))
+
+
+class PinnedExecutor:
+    """
+    Render processes with every key (an instrument or workbook name) pinned to one of them, so versions of the
+    same instrument are rendered one after another, in order, by the process holding its IncrementalRenderer
+    cache. Keys are spread by a stable hash; one slow instrument only holds up the others sharing its process.
+    """
+
+    def __init__(self, max_workers, initializer=None):
+        # Spawned workers start clean instead of inheriting the caller's threads through fork
+        context = multiprocessing.get_context('spawn')
+        self.executors = [ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=initializer)
+                          for _ in range(max_workers)]
+
+    def executor(self, key):
+        return self.executors[zlib.crc32(key.encode('utf-8')) % len(self.executors)]
+
+    def submit(self, key, fn, *args):
+        return self.executor(key).submit(fn, *args)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        for executor in self.executors:
+            executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+
+def collect_finished_renders(in_flight, processed_files, render_gate, intake):
+    for future in [future for future in in_flight if future.done()]:
+        excel_path, signature, fingerprint = in_flight.pop(future)
+        intake.finish(excel_path)
+        try:
+            image_file = metrics.merge_collected(future.result())
+        except Exception as e:
+            print(f"Render worker failed on {excel_path}: {e}")
+            continue
+        if image_file:
+            print(f"Processed and saved image: {image_file}")
+            processed_files.add((excel_path, signature))
+            render_gate.update(os.path.basename(excel_path), fingerprint)
+
+
+def process_directory_continuously(input_dir, output_dir, run_duration= 5 * 3600, check_interval=STABLE_CHECK_INTERVAL,
+                                   max_workers=RENDER_WORKERS):
     """
     Process the directory continuously for a specified duration and convert any new Excel files to images.
     
     :param input_dir: Directory to monitor for new Excel files.
     :param output_dir: Directory to save the converted images.
-    :param run_duration: Duration to run the process (in seconds). Default is 1 hour.
-    :param check_interval: Interval (in seconds) to check for new files. Default is 10 seconds.
+    :param run_duration: Duration to run the process (in seconds). Default is 5 hours.
+    :param check_interval: Interval (in seconds) between checks that a new file is completely written.
+    :param max_workers: Number of processes rendering workbooks in parallel.
     """
     start_time = time.time()
-    processed_files = set()
+    processed_files = BoundedSet(PROCESSED_HISTORY)  # (path, size, mtime) of workbooks already converted
+    in_flight = {}  # future -> (path, (size, mtime), fingerprint) of workbooks being rendered
+    render_gate = FingerprintGate('Render')  # Checked here, not in the workers, so it sees every workbook in order
 
     # Ensure output directory exists
     os.makedirs(output_dir, exist_ok=True)
 
-    while time.time() - start_time < run_duration:
-        for excel_file in os.listdir(input_dir):
-            if excel_file.endswith('.xlsx') and excel_file not in processed_files:
-                excel_path = os.path.join(input_dir, excel_file)
-                image_file = excel_to_table_image(excel_path, output_dir)
-                if image_file:
-                    print(f"Processed and saved image: {image_file}")
-                    processed_files.add(excel_file)
+    executor = PinnedExecutor(max_workers, initializer=init_render_worker)
+
+    intake = WorkbookIntake()
+    observer = Observer()
+    observer.schedule(intake, path=input_dir, recursive=False)
+    observer.start()
+
+    # Pick up workbooks that were written before the watcher started
+    for excel_file in os.listdir(input_dir):
+        intake.add(os.path.join(input_dir, excel_file))
 
-        time.sleep(check_interval)  # Wait before checking for new files again
+    try:
+        while time.time() - start_time < run_duration:
+            collect_finished_renders(in_flight, processed_files, render_gate, intake)
+
+            if not intake.has_pending():
+                intake.wakeup.wait(timeout=1)
+                intake.wakeup.clear()
+                continue
 
+            time.sleep(check_interval)
+            for excel_path, signature in intake.ready_files():
+                if (excel_path, signature) in processed_files:
+                    continue
+                fingerprint = read_workbook_fingerprint(excel_path)
+                if render_gate.is_repeat(os.path.basename(excel_path), fingerprint):
+                    print(f"{excel_path} has the same data as the last image. Skipping.")
+                    processed_files.add((excel_path, signature))
+                    remove_workbook(excel_path, signature)
+                    continue
+                intake.start(excel_path)  # A version written meanwhile stays pending until this render is done
+                future = executor.submit(os.path.basename(excel_path), metrics.call_collected, excel_to_table_image,
+                                         excel_path, output_dir, fingerprint, signature)
+                future.add_done_callback(lambda _: intake.wakeup.set())
+                in_flight[future] = (excel_path, signature, fingerprint)
+    finally:
+        observer.stop()
+        observer.join()
+        executor.shutdown(wait=True)
+        collect_finished_renders(in_flight, processed_files, render_gate, intake)
+
+    render_gate.summarize()
+    metrics.summarize()
     print("Processing complete.")
 
 if __name__ == "__main__":
-    if len(sys.argv) == 3:
+    if len(sys.argv) == 2 and sys.argv[1] == '--benchmark':
+        benchmark_cell_styles()
+    elif len(sys.argv) == 4 and sys.argv[1] == '--compare-backends':
+        compare_backends(read_workbook(sys.argv[2]), sys.argv[3])
+    elif len(sys.argv) in (3, 4):
         # Command-line mode for directory processing
         input_dir = sys.argv[1]
         output_dir = sys.argv[2]
-        process_directory_continuously(input_dir, output_dir)
+        max_workers = int(sys.argv[3]) if len(sys.argv) == 4 else RENDER_WORKERS
+        metrics.start_exporters(METRICS_PORT, METRICS_JSONL)
+        process_directory_continuously(input_dir, output_dir, max_workers=max_workers)
     else:
         print("Usage:")
-        print("For directory: python excel_image.py <input_dir> <output_dir>")
+        print("For directory: python excel_image.py <input_dir> <output_dir> [render_workers]")
+        print("Styling benchmark: python excel_image.py --benchmark")
+        print("Backend parity check: python excel_image.py --compare-backends <excel_file> <output_dir>")
         sys.exit(1)
\ No newline at end of file
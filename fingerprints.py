@@ -0,0 +1,5 @@
+# Markers for the scraper's table fingerprint (database_trial_main.sheets_fingerprint), shared by all three stages:
+# the scraper writes it into the workbook keywords, the renderer copies it into the image metadata and the poster
+# reads it back to skip images whose tables were already posted.
+FINGERPRINT_PREFIX = 'fingerprint:'
+EXIF_IMAGE_DESCRIPTION = 0x010E  # WebP has no comment field; the fingerprint goes in this EXIF tag instead
@@ -0,0 +1,231 @@
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Timers, counters and latency percentiles for the scrape, render and post stages. Code records with timer(),
+# timed(), observe() and count(); start_exporters() serves the numbers as Prometheus text on a local port and
+# appends a JSON snapshot to a JSONL file every METRICS_INTERVAL seconds. Each script passes its own file (its
+# METRICS_JSONL, next to its METRICS_PORT), which is rotated once it reaches METRICS_MAX_BYTES. Render processes
+# hand what they recorded back to the parent through call_collected() / merge_collected().
+METRICS_JSONL = 'metrics.jsonl'  # Default file for start_exporters(); None turns the periodic snapshots off
+METRICS_INTERVAL = 60  # Seconds between JSONL snapshots
+METRICS_MAX_BYTES = 10 * 1024 * 1024  # A snapshot file this large is moved to <file>.1 before the next snapshot
+METRICS_BACKUPS = 3  # Rotated files kept (<file>.1 is the newest); older ones are deleted
+METRICS_HOST = '127.0.0.1'
+METRIC_PREFIX = 'stock_market_'
+HISTOGRAM_SAMPLES = 1000  # Most recent observations kept per timer for the percentiles
+PERCENTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    """Count and total of every observation, and the most recent HISTOGRAM_SAMPLES for the percentiles."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=HISTOGRAM_SAMPLES)
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self.samples.append(value)
+
+    def percentiles(self):
+        samples = sorted(self.samples)
+        return {q: samples[min(len(samples) - 1, int(q * len(samples)))] if samples else 0.0 for q in PERCENTILES}
+
+
+class Registry:
+    """Counters and timer histograms by dotted name ('render.draw'). Safe to record into from any thread."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.pending = None  # Observations made during call_collected(), to be sent back to the parent process
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+            if self.pending is not None:
+                self.pending.append(('count', name, amount))
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+            if self.pending is not None:
+                self.pending.append(('observe', name, seconds))
+
+    def merge(self, pending):
+        for kind, name, value in pending:
+            if kind == 'count':
+                self.count(name, value)
+            else:
+                self.observe(name, value)
+
+    def snapshot(self):
+        with self.lock:
+            timers = {}
+            for name, histogram in sorted(self.histograms.items()):
+                timers[name] = {'count': histogram.count, 'sum': round(histogram.total, 6)}
+                timers[name].update({f"p{round(q * 100)}": round(value, 6)
+                                     for q, value in histogram.percentiles().items()})
+            return {'time': time.time(), 'process': os.path.basename(sys.argv[0]), 'pid': os.getpid(),
+                    'counters': dict(sorted(self.counters.items())), 'timers': timers}
+
+    def prometheus_text(self):
+        """The registry in the Prometheus text exposition format: counters as *_total, timers as summaries."""
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in snapshot['counters'].items():
+            metric = METRIC_PREFIX + name.replace('.', '_') + '_total'
+            lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+        for name, timer in snapshot['timers'].items():
+            metric = METRIC_PREFIX + name.replace('.', '_') + '_seconds'
+            lines.append(f"# TYPE {metric} summary")
+            lines += [f'{metric}{{quantile="{q}"}} {timer[f"p{round(q * 100)}"]}' for q in PERCENTILES]
+            lines += [f"{metric}_sum {timer['sum']}", f"{metric}_count {timer['count']}"]
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def count(name, amount=1):
+    registry.count(name, amount)
+
+
+def observe(name, seconds):
+    registry.observe(name, seconds)
+
+
+class Timer:
+    seconds = None  # Set when the timed block ends
+
+
+@contextmanager
+def timer(name):
+    """Time the block under name, also when it raises. The yielded Timer holds the seconds once the block ends."""
+    result = Timer()
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        result.seconds = time.perf_counter() - start
+        registry.observe(name, result.seconds)
+
+
+def timed(name):
+    """Decorator form of timer()."""
+    def decorate(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def call_collected(function, *args):
+    """
+    Run function(*args) in a worker process and return (result, observations made meanwhile), so the parent can
+    merge_collected() them into its own registry. Workers run one call at a time, so nothing else is mixed in.
+    """
+    registry.pending = []
+    try:
+        return function(*args), registry.pending
+    finally:
+        registry.pending = None
+
+
+def merge_collected(collected):
+    result, pending = collected
+    registry.merge(pending)
+    return result
+
+
+def summarize():
+    """Print p50/p95/p99 of every timer."""
+    for name, timer_stats in registry.snapshot()['timers'].items():
+        print(f"{name}: p50 {timer_stats['p50']:.3f}s, p95 {timer_stats['p95']:.3f}s, "
+              f"p99 {timer_stats['p99']:.3f}s over {timer_stats['count']}")
+
+
+snapshot_lock = threading.Lock()  # The snapshot thread and the exit handler may write at the same time
+
+
+def rotate(path, max_bytes=METRICS_MAX_BYTES, backups=METRICS_BACKUPS):
+    """Once path reaches max_bytes, shift it to path.1 (path.1 to path.2 and so on), dropping the oldest."""
+    try:
+        if os.path.getsize(path) < max_bytes:
+            return
+    except FileNotFoundError:
+        return
+    if backups < 1:
+        os.remove(path)
+        return
+    for index in range(backups - 1, 0, -1):
+        if os.path.exists(f"{path}.{index}"):
+            os.replace(f"{path}.{index}", f"{path}.{index + 1}")
+    os.replace(path, f"{path}.1")
+
+
+def write_snapshot(path=METRICS_JSONL):
+    with snapshot_lock:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        rotate(path)
+        with open(path, 'a') as f:
+            f.write(json.dumps(registry.snapshot()) + '\n')
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = registry.prometheus_text().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes every few seconds would drown the scripts' own output
+
+
+def write_snapshots(path, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            write_snapshot(path)
+        except OSError as e:
+            print(f"Could not write metrics to {path}: {e}")
+
+
+def start_exporters(port, jsonl_path=METRICS_JSONL, interval=METRICS_INTERVAL):
+    """
+    Serve the Prometheus endpoint on port (None for no endpoint) and append snapshots to jsonl_path (None for no
+    file), both from daemon threads. A last snapshot is written when the process exits. Give every process its
+    own jsonl_path; the rotation assumes a single writer.
+    """
+    if port is not None:
+        try:
+            server = ThreadingHTTPServer((METRICS_HOST, port), MetricsHandler)
+        except OSError as e:
+            print(f"Metrics endpoint not started on port {port}: {e}")
+        else:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            print(f"Metrics at http://{METRICS_HOST}:{port}/metrics")
+    if jsonl_path is not None:
+        threading.Thread(target=write_snapshots, args=(jsonl_path, interval), daemon=True).start()
+        atexit.register(write_snapshot, jsonl_path)
@@ -0,0 +1,168 @@
+import asyncio
+import importlib
+import os
+import signal
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import metrics
+import excel_image_main as renderer
+
+# Spawned render processes re-import this script as __mp_main__. They only run excel_image_main.render_sheets,
+# so they skip Selenium, the bot and the poster.
+if __name__ != '__mp_main__':
+    from telegram.ext import ApplicationBuilder
+
+    import database_trial_main as scraper
+    poster = importlib.import_module('best_photo_posting-qulity')
+
+# Single-process pipeline: scrape -> render -> post, connected by bounded queues. Scraped DataFrames go straight
+# to the render processes and the encoded images straight to the upload queue, so nothing passes through
+# ../Task_12/ and the three stages no longer race on files there. A full queue makes the stage before it wait.
+ARCHIVE_XLSX = False  # Also keep each scraped workbook in ARCHIVE_DIR
+ARCHIVE_IMAGES = False  # Also keep each rendered image in ARCHIVE_DIR
+ARCHIVE_DIR = 'archive/'
+QUEUE_SIZE = 10  # Scraped instruments waiting for a render process
+UPLOAD_QUEUE_SIZE = 10  # Rendered images waiting for an upload worker
+RENDER_WORKERS = 2  # Render processes; matplotlib is CPU bound, so they run outside the event loop's process
+RUN_DURATION = timedelta(hours=5)
+METRICS_JSONL = 'metrics_pipeline.jsonl'  # All three stages' metrics; the endpoint is the scraper's METRICS_PORT
+
+
+async def scrape_stage(drivers, change_detector, queue, end_time, consumers):
+    async def hand_off(result):
+        sheet_name, sheets, fingerprint = result
+        if sheets is not None:
+            await queue.put((sheet_name, sheets, fingerprint, time.time()))
+
+    try:
+        await scraper.run_cycles(drivers, change_detector, end_time, scrape=scraper.scrape_tab_frames,
+                                 on_result=hand_off)
+    finally:
+        for _ in range(consumers):
+            await queue.put(None)  # Tell each render task there is nothing more to come
+
+
+def archive_workbook(sheet_name, sheets, fingerprint):
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    scraper.write_workbook(sheets, os.path.join(ARCHIVE_DIR, f"{sheet_name}_{time.strftime('%H%M%S')}.xlsx"),
+                           fingerprint)
+
+
+def archive_image(image_name, data):
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    stem, extension = os.path.splitext(image_name)
+    with open(os.path.join(ARCHIVE_DIR, f"{stem}_{time.strftime('%H%M%S')}{extension}"), 'wb') as image_file:
+        image_file.write(data)
+
+
+async def render_stage(queue, uploads, executor, render_gate, instrument_locks):
+    """
+    Render queued instruments and hand the images to the uploads. An instrument's lock is held from the render
+    gate check until its image is submitted, so versions of one instrument are gated, rendered (by the process
+    the executor pins it to) and submitted in scrape order, even with several render tasks.
+    """
+    while True:
+        item = await queue.get()
+        if item is None:
+            break
+        sheet_name, sheets, fingerprint, scraped_at = item
+        async with instrument_locks[sheet_name]:
+            await render_instrument(sheet_name, sheets, fingerprint, scraped_at, uploads, executor, render_gate)
+
+
+async def render_instrument(sheet_name, sheets, fingerprint, scraped_at, uploads, executor, render_gate):
+    if render_gate.is_repeat(sheet_name, fingerprint):
+        print(f"{sheet_name} has the same data as the last image. Skipping.")
+        return
+    if ARCHIVE_XLSX:
+        await asyncio.to_thread(archive_workbook, sheet_name, sheets, fingerprint)
+    try:
+        data = metrics.merge_collected(await asyncio.wrap_future(executor.submit(
+            sheet_name, metrics.call_collected, renderer.render_sheets, sheet_name, sheets, fingerprint)))
+    except Exception as e:
+        print(f"Error rendering {sheet_name}: {e}")
+        return
+    if data is None:
+        return
+    render_gate.update(sheet_name, fingerprint)
+    metrics.observe('pipeline.scrape_to_render', time.time() - scraped_at)
+    image_name = os.path.basename(renderer.image_path('', sheet_name))
+    print(f"Rendered {image_name} {time.time() - scraped_at:.2f} seconds after scraping")
+    if ARCHIVE_IMAGES:
+        await asyncio.to_thread(archive_image, image_name, data)
+    await uploads.submit(image_name, data)  # Waits while the upload queue is full
+
+
+async def report_stage(queue, uploads):
+    while True:
+        await asyncio.sleep(poster.STATS_INTERVAL)
+        print(f"Pipeline: {queue.qsize()}/{queue.maxsize} instruments waiting to render")
+        uploads.summarize()
+
+
+def install_stop_handlers(stop):
+    """Set stop on Ctrl+C or SIGTERM, so the pipeline drains instead of dying mid-upload."""
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signal_number, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows event loops have no signal handlers; Ctrl+C then stops without draining
+
+
+async def main():
+    end_time = datetime.now() + RUN_DURATION
+    queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    stop = asyncio.Event()
+    install_stop_handlers(stop)
+
+    application = (ApplicationBuilder().token(poster.BOT_TOKEN).base_url(poster.BOT_API_BASE_URL)
+                   .connection_pool_size(poster.UPLOAD_CONCURRENCY).build())
+    journal = poster.UploadJournal()
+    uploads = poster.UploadQueue(application.bot, journal, maxsize=UPLOAD_QUEUE_SIZE)
+    uploads.start()
+    metrics.start_exporters(scraper.METRICS_PORT, METRICS_JSONL)
+    # Each instrument renders in the same process every time (its incremental canvas lives there)
+    executor = renderer.PinnedExecutor(RENDER_WORKERS, initializer=renderer.init_render_worker)
+
+    change_detector = scraper.ChangeDetector()
+    if scraper.RECORD_TICKS:
+        scraper.tick_store = scraper.TickStore()
+    drivers = await scraper.create_driver_pool(scraper.NUM_WORKERS)
+    render_gate = renderer.FingerprintGate('Render')
+    instrument_locks = defaultdict(asyncio.Lock)
+    render_tasks = [asyncio.create_task(render_stage(queue, uploads, executor, render_gate, instrument_locks))
+                    for _ in range(RENDER_WORKERS)]
+    report_task = asyncio.create_task(report_stage(queue, uploads))
+    try:
+        scrape_task = asyncio.create_task(scrape_stage(drivers, change_detector, queue, end_time, len(render_tasks)))
+        stop_task = asyncio.create_task(stop.wait())
+        await asyncio.wait([scrape_task, stop_task], return_when=asyncio.FIRST_COMPLETED)
+        if not scrape_task.done():
+            print("Stopping: finishing the work already queued...")
+            scrape_task.cancel()
+        stop_task.cancel()
+        await asyncio.gather(scrape_task, return_exceptions=True)
+
+        # Drain: the render tasks stop at their end markers, then the uploads finish what they were given
+        await asyncio.gather(*render_tasks)
+        await uploads.drain()
+    finally:
+        report_task.cancel()
+        for task in render_tasks:
+            task.cancel()
+        await uploads.stop()
+        executor.shutdown(cancel_futures=True)
+        for driver in drivers:
+            driver.quit()
+        if scraper.tick_store is not None:
+            scraper.tick_store.close()
+        journal.close()
+        render_gate.summarize()
+        uploads.summarize()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+import asyncio
+import time
+from collections import defaultdict, deque
+
+from aiohttp import web
+
+
+class FakeBotApi:
+    """
+    A local stand-in for the Telegram Bot API, for pointing the poster's BOT_API_BASE_URL at. It answers every
+    method with success unless failures were queued for it, and records each call.
+
+    Start it inside a running event loop: base_url = await api.start(); ...; await api.stop().
+    """
+
+    def __init__(self):
+        self.calls = []  # (method, time, file names) per request, in arrival order
+        self.failures = defaultdict(deque)  # method -> (status, description, parameters) of the errors still to return
+        self.delay = 0.0  # Seconds every answer takes, to keep uploads in flight
+        self.runner = None
+        self.message_id = 0
+
+    def fail(self, method, status, description, parameters=None):
+        """Answer the next call of method, after any failures already queued, with an error."""
+        self.failures[method].append((status, description, parameters))
+
+    def retry_after(self, method, seconds):
+        self.fail(method, 429, f"Too Many Requests: retry after {seconds}", {'retry_after': seconds})
+
+    def methods(self):
+        return [method for method, _, _ in self.calls]
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        files = []
+        if request.content_type.startswith('multipart/'):
+            files = [field.filename for field in (await request.post()).values() if hasattr(field, 'filename')]
+        self.calls.append((method, time.monotonic(), files))
+        await asyncio.sleep(self.delay)
+
+        if self.failures[method]:
+            status, description, parameters = self.failures[method].popleft()
+            body = {'ok': False, 'error_code': status, 'description': description}
+            if parameters:
+                body['parameters'] = parameters
+            return web.json_response(body, status=status)
+
+        if method == 'getMe':
+            return web.json_response({'ok': True, 'result': {'id': 1, 'is_bot': True, 'first_name': 'Fake',
+                                                             'username': 'fake_bot'}})
+        messages = [self.message() for _ in (files if method == 'sendMediaGroup' else [None])]
+        return web.json_response({'ok': True, 'result': messages if method == 'sendMediaGroup' else messages[0]})
+
+    def message(self):
+        self.message_id += 1
+        return {'message_id': self.message_id, 'date': int(time.time()), 'chat': {'id': -1, 'type': 'channel'}}
+
+    async def start(self, host='127.0.0.1', port=0):
+        """Listen on host:port (a free port by default) and return the base URL for the bot."""
+        app = web.Application(client_max_size=50 * 2 ** 20)
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}/bot"
+
+    async def stop(self):
+        await self.runner.cleanup()
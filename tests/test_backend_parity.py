@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import excel_image_main as renderer
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'backend_parity.xlsx')
+
+
+@pytest.fixture(scope='module')
+def rendered(tmp_path_factory):
+    """Both backends' images of the fixture workbook, flattened, with the regions to compare."""
+    output_dir = str(tmp_path_factory.mktemp('parity'))
+    df = renderer.read_workbook(FIXTURE)
+    mismatches = renderer.compare_backends(df, output_dir)
+    images = [renderer.flatten_image(Image.open(renderer.image_path(output_dir, f"backend_{backend}")))
+              for backend in ('matplotlib', 'pil')]
+    frames = {sheet_name: data.copy() for sheet_name, data in df.items()}
+    regions = renderer.layout_regions(renderer.prepare_sheets(frames), renderer.figure_size(frames))
+    return mismatches, images, regions
+
+
+def failed(reference, candidate, regions):
+    return [(kind, label) for kind, label, _, ok in renderer.compare_regions(reference, candidate, regions) if not ok]
+
+
+def region(regions, kind, label):
+    return next(box for region_kind, region_label, box, _ in regions if (region_kind, region_label) == (kind, label))
+
+
+def test_backends_match_region_by_region(rendered):
+    mismatches, _, regions = rendered
+    assert {kind for kind, _, _, _ in regions} == {'title bar', 'table', 'cell'}
+    assert mismatches == []
+
+
+def test_shifted_title_bar_is_reported(rendered):
+    _, (reference, candidate), regions = rendered
+    left, top, right, bottom = region(regions, 'title bar', '3 Min')
+    shifted = candidate.copy()
+    shifted[top - 12:bottom + 12, left:right] = np.roll(candidate[top - 12:bottom + 12, left:right], 8, axis=0)
+    assert failed(reference, shifted, regions) == [('title bar', '3 Min')]
+
+
+def test_missing_grid_line_is_reported(rendered):
+    _, (reference, candidate), regions = rendered
+    left, top, right, bottom = region(regions, 'table', '5 Min')
+    erased = candidate.copy()
+    window = erased[top - 12:bottom + 12, left - 12:right + 12]
+    line = renderer.grid_lines(window, 0)[3]
+    rows = slice(round(line) - 6, round(line) + 7)
+    window[rows] = np.where(renderer.color_mask(window[rows], renderer.GRID_COLOR)[..., None],
+                            window[round(line) - 12][None], window[rows])
+    assert ('table', '5 Min') in failed(reference, erased, regions)
+
+
+def test_moved_cell_text_is_reported(rendered):
+    _, (reference, candidate), regions = rendered
+    label = 'NIFTY cell 3,1'
+    left, top, right, bottom = region(regions, 'cell', label)
+    moved = candidate.copy()
+    moved[top:bottom, left:right] = np.roll(candidate[top:bottom, left:right], (bottom - top) // 2, axis=1)
+    assert failed(reference, moved, regions) == [('cell', label)]
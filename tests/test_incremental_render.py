@@ -0,0 +1,40 @@
+import os
+
+import excel_image_main as renderer
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'backend_parity.xlsx')
+
+
+def prepared_sheets(change=None):
+    frames = {sheet_name: data.copy() for sheet_name, data in renderer.read_workbook(FIXTURE).items()}
+    if change is not None:
+        frames[next(iter(frames))].iat[3, 1] = change
+    return renderer.prepare_sheets(frames), renderer.figure_size(frames)
+
+
+def test_unchanged_render_keeps_the_last_image(tmp_path):
+    image_file = renderer.image_path(str(tmp_path), 'NIFTY')
+    incremental = renderer.IncrementalRenderer()
+    assert incremental.render('NIFTY', *prepared_sheets(), image_file) == image_file
+    written = os.stat(image_file).st_mtime_ns
+
+    assert incremental.render('NIFTY', *prepared_sheets(), image_file) is None
+    assert os.stat(image_file).st_mtime_ns == written
+
+
+def test_changing_back_is_rendered(tmp_path):
+    image_file = renderer.image_path(str(tmp_path), 'NIFTY')
+    incremental = renderer.IncrementalRenderer()
+    incremental.render('NIFTY', *prepared_sheets(), image_file)
+    assert incremental.render('NIFTY', *prepared_sheets(change=999), image_file) == image_file
+    assert incremental.render('NIFTY', *prepared_sheets(), image_file) == image_file  # A -> B -> A
+
+
+def test_versions_of_a_workbook_go_to_one_process():
+    executor = renderer.PinnedExecutor(4)
+    try:
+        for name in ('NIFTY _1.xlsx', 'BANKNIFTY _1.xlsx', 'FINNIFTY _1.xlsx'):
+            assert executor.executor(name) is executor.executor(name)
+        assert len({executor.executor(f"{n}.xlsx") for n in range(40)}) > 1
+    finally:
+        executor.shutdown()
@@ -0,0 +1,24 @@
+import json
+
+import metrics
+
+
+def test_snapshot_file_is_rotated_at_the_size_cap(tmp_path, monkeypatch):
+    path = str(tmp_path / 'metrics_render.jsonl')
+    monkeypatch.setattr(metrics.rotate, '__defaults__', (1, 2))  # Rotate at every snapshot, keep two old files
+    for _ in range(4):
+        metrics.write_snapshot(path)
+
+    for name in ('metrics_render.jsonl', 'metrics_render.jsonl.1', 'metrics_render.jsonl.2'):
+        with open(tmp_path / name) as f:
+            assert [set(json.loads(line)) >= {'timers', 'counters'} for line in f] == [True]
+    assert not (tmp_path / 'metrics_render.jsonl.3').exists()
+
+
+def test_small_file_is_appended_to(tmp_path):
+    path = str(tmp_path / 'metrics_post.jsonl')
+    metrics.write_snapshot(path)
+    metrics.write_snapshot(path)
+    with open(path) as f:
+        assert len(f.readlines()) == 2
+    assert not (tmp_path / 'metrics_post.jsonl.1').exists()
@@ -0,0 +1,132 @@
+import json
+import os
+
+import pytest
+
+import database_trial_main as scraper
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), 'fixtures', 'capture')
+OPTION_FIXTURE = '001_api_derivative_oiData_category_niftyW.json'
+INTERVAL_FIXTURE = '002_api_derivative_interval_3min_niftyW.json'
+OPTION_HEADERS = ['Strike', 'Call OI', 'Call Change', 'PCR', 'Put Change', 'Put OI']
+INTERVAL_HEADERS = ['Time', 'Price', 'VWAP', 'OI', 'OI Change', 'Signal']
+
+
+def fixture_body(filename):
+    with open(os.path.join(FIXTURE_DIR, filename), encoding='utf-8') as f:
+        return f.read()
+
+
+def log_entry(method, **params):
+    return {'message': json.dumps({'message': {'method': method, 'params': params}})}
+
+
+class FakeDriver:
+    """Stands in for a Chrome driver with performance logging: only the calls network capture makes."""
+
+    def __init__(self):
+        self.log = []
+        self.bodies = {}
+        self.headers = {0: OPTION_HEADERS, 1: INTERVAL_HEADERS}
+
+    def respond(self, request_id, url, body, finished=True):
+        self.bodies[request_id] = body
+        self.log.append(log_entry('Network.responseReceived', requestId=request_id,
+                                  response={'url': url, 'mimeType': 'application/json'}))
+        if finished:
+            self.finish(request_id)
+
+    def finish(self, request_id):
+        self.log.append(log_entry('Network.loadingFinished', requestId=request_id))
+
+    def fail(self, request_id):
+        self.log.append(log_entry('Network.loadingFailed', requestId=request_id, errorText='net::ERR_ABORTED'))
+
+    def get_log(self, log_type):
+        entries, self.log = self.log, []
+        return entries
+
+    def execute_cdp_cmd(self, command, params):
+        return {'body': self.bodies[params['requestId']], 'base64Encoded': False}
+
+    def execute_script(self, script, table_index):
+        assert script == scraper.TABLE_HEADERS_JS, "DOM scraping fallback was used"
+        return self.headers[table_index]
+
+    def find_elements(self, *args):
+        raise AssertionError("DOM scraping fallback was used")
+
+
+@pytest.fixture
+def capture_on(monkeypatch):
+    monkeypatch.setattr(scraper, 'USE_NETWORK_CAPTURE', True)
+
+
+def test_replay_parses_saved_bodies():
+    tables = scraper.replay_captured_responses(FIXTURE_DIR)
+    assert list(tables) == [OPTION_FIXTURE, INTERVAL_FIXTURE]
+    assert tables[OPTION_FIXTURE].shape == (3, 6)
+    assert tables[INTERVAL_FIXTURE]['time'].tolist() == [1512, 1509, 1506]
+
+
+def test_captured_frame_has_dom_shape():
+    records = scraper.replay_captured_responses(FIXTURE_DIR)[INTERVAL_FIXTURE]
+    frame = scraper.captured_table_frame(records, INTERVAL_HEADERS)
+    assert list(frame.columns) == INTERVAL_HEADERS
+    assert frame.iloc[0].isna().all()  # The header <tr> row the renderer's time gate expects
+    assert frame.iloc[1].tolist() == ['1512', '22440.1', '22431.5', '120400', '1500', 'BUY']
+
+
+def test_captured_frame_blanks_nulls_and_uses_column_map():
+    records = scraper.replay_captured_responses(FIXTURE_DIR)[OPTION_FIXTURE]
+    headers = ['Strike', 'CE OI', 'Put Change']
+    assert scraper.captured_table_frame(records, headers) is None
+    frame = scraper.captured_table_frame(records, headers, {'CE OI': 'callOi'})
+    assert list(frame.columns) == headers
+    assert frame['Put Change'].tolist()[1:] == ['820', '', '-120']
+
+
+def test_each_table_keeps_its_captured_response(capture_on):
+    driver = FakeDriver()
+    driver.respond('1', 'https://example.com/api/derivative/oiData?category=niftyW', fixture_body(OPTION_FIXTURE))
+    driver.respond('2', 'https://example.com/api/derivative/interval?tf=3', fixture_body(INTERVAL_FIXTURE))
+
+    option = scraper.extract_table(driver, table_index=0)
+    three_minute = scraper.extract_table(driver, table_index=1)
+    fifteen_minute = scraper.extract_table(driver, table_index=1)  # No tab click: the table on screen is unchanged
+
+    assert list(option.columns) == OPTION_HEADERS
+    assert option['Strike'].tolist()[1:] == ['22400', '22450', '22500']
+    assert three_minute['Time'].tolist()[1:] == ['1512', '1509', '1506']
+    assert fifteen_minute.equals(three_minute)
+
+
+def test_response_finishing_in_a_later_read_is_kept(capture_on):
+    driver = FakeDriver()
+    driver.respond('7', 'https://example.com/api/derivative/interval?tf=5', fixture_body(INTERVAL_FIXTURE),
+                   finished=False)
+    assert scraper.capture_network_table(driver, 1) is None
+    driver.finish('7')
+    assert scraper.capture_network_table(driver, 1)['Signal'].tolist()[1:] == ['BUY', 'SELL', 'SELL']
+
+
+def test_reset_drops_the_previous_page(capture_on):
+    driver = FakeDriver()
+    driver.respond('1', 'https://example.com/api/derivative/oiData?category=niftyW', fixture_body(OPTION_FIXTURE))
+    assert scraper.capture_network_table(driver, 0) is not None
+    scraper.reset_network_capture(driver)
+    assert scraper.capture_network_table(driver, 0) is None
+
+
+def test_failed_request_is_forgotten(capture_on):
+    driver = FakeDriver()
+    driver.respond('8', 'https://example.com/api/derivative/interval?tf=15', fixture_body(INTERVAL_FIXTURE),
+                   finished=False)
+    driver.respond('9', 'https://example.com/api/derivative/interval?tf=3', fixture_body(INTERVAL_FIXTURE),
+                   finished=False)
+    driver.fail('8')
+    assert scraper.capture_network_table(driver, 1) is None
+    assert list(scraper.network_capture(driver).pending) == ['9']
+
+    scraper.reset_network_capture(driver)  # '9' belonged to the previous page and never finished
+    assert scraper.network_capture(driver).pending == {}
@@ -0,0 +1,54 @@
+import asyncio
+import threading
+from collections import defaultdict
+from concurrent.futures import Future
+
+import excel_image_main as renderer
+import pipeline_main as pipeline
+
+
+class SlowFirstExecutor:
+    """Stands in for PinnedExecutor: the first render takes longest, so unserialized renders would finish reversed."""
+
+    def __init__(self):
+        self.delays = [0.3, 0.0, 0.0]
+        self.running = 0
+        self.overlapped = False
+
+    def submit(self, key, function, *args):
+        sheet_name, sheets, fingerprint = args[1:]
+        future = Future()
+        self.running += 1
+        self.overlapped |= self.running > 1
+
+        def finish():
+            self.running -= 1
+            future.set_result((fingerprint.encode(), []))
+
+        threading.Timer(self.delays.pop(0), finish).start()
+        return future
+
+
+class RecordingUploads:
+    def __init__(self):
+        self.submitted = []
+
+    async def submit(self, image_name, data):
+        self.submitted.append((image_name, data))
+
+
+def test_versions_of_an_instrument_are_rendered_and_posted_in_order():
+    async def run():
+        queue = asyncio.Queue()
+        for fingerprint in ('v1', 'v2', 'v1'):
+            queue.put_nowait(('NIFTY', {}, fingerprint, 0.0))
+        for _ in range(3):
+            queue.put_nowait(None)
+        executor, uploads = SlowFirstExecutor(), RecordingUploads()
+        render_gate, locks = renderer.FingerprintGate('Render'), defaultdict(asyncio.Lock)
+        await asyncio.gather(*(pipeline.render_stage(queue, uploads, executor, render_gate, locks) for _ in range(3)))
+        return executor, uploads
+
+    executor, uploads = asyncio.run(run())
+    assert not executor.overlapped
+    assert [data for _, data in uploads.submitted] == [b'v1', b'v2', b'v1']
@@ -0,0 +1,69 @@
+import pandas as pd
+import pytest
+
+import database_trial_main as scraper
+
+URL = 'https://example.com/option-chain/NIFTY'
+
+
+class LoadedWait:
+    """WebDriverWait stand-in for a page whose table is already there."""
+
+    def __init__(self, driver, timeout):
+        pass
+
+    def until(self, condition):
+        return True
+
+
+class FakeDriver:
+    def get(self, url):
+        pass
+
+
+@pytest.fixture
+def page(monkeypatch):
+    """The option table scrape_instrument reads, and the interval tabs it opened, in order."""
+    state = {'option': pd.DataFrame({'Strike': ['', '22000'], 'Call OI': ['', '10']}), 'tabs': []}
+    monkeypatch.setattr(scraper, 'WebDriverWait', LoadedWait)
+    monkeypatch.setattr(scraper, 'handle_popups', lambda driver: None)
+    monkeypatch.setattr(scraper, 'reset_network_capture', lambda driver: None)
+    monkeypatch.setattr(scraper, 'switch_interval_tab', lambda driver, button, label: state['tabs'].append(label))
+    monkeypatch.setattr(scraper, 'extract_table', lambda driver, table_index=0: state['option'] if table_index == 0
+                        else pd.DataFrame({'Time': ['', '0915'], 'Price': ['', '101']}))
+    monkeypatch.setattr(scraper, 'interval_frames', {})
+    return state
+
+
+def test_unchanged_option_table_still_scrapes_the_closed_candle(page, tmp_path):
+    detector = scraper.ChangeDetector(str(tmp_path / 'previous_data.json'))
+    sheets, digest = scraper.scrape_instrument(FakeDriver(), URL, detector)
+    assert set(sheets) == {'Option', '3 Min', '5 Min', '15 Min'}
+    detector.update(URL, digest)
+
+    page['tabs'].clear()
+    sheets, _ = scraper.scrape_instrument(FakeDriver(), URL, detector, intervals={'3 Min'})
+    assert page['tabs'] == ['3 Min'] and detector.skipped == 0
+    assert set(sheets) == {'Option', '3 Min', '5 Min', '15 Min'}
+
+
+def test_unchanged_option_table_without_a_candle_close_is_skipped(page, tmp_path):
+    detector = scraper.ChangeDetector(str(tmp_path / 'previous_data.json'))
+    _, digest = scraper.scrape_instrument(FakeDriver(), URL, detector)
+    detector.update(URL, digest)
+
+    page['tabs'].clear()
+    assert scraper.scrape_instrument(FakeDriver(), URL, detector, intervals=set()) == (None, None)
+    assert scraper.scrape_instrument(FakeDriver(), URL, detector) == (None, None)
+    assert page['tabs'] == [] and detector.skipped == 2
+
+
+def test_candle_close_only_opens_the_due_tabs(page, tmp_path):
+    detector = scraper.ChangeDetector(str(tmp_path / 'previous_data.json'))
+    scraper.scrape_instrument(FakeDriver(), URL, detector)
+
+    page['option'] = pd.DataFrame({'Strike': ['', '22000'], 'Call OI': ['', '12']})
+    page['tabs'].clear()
+    sheets, _ = scraper.scrape_instrument(FakeDriver(), URL, detector, intervals={'3 Min'})
+    assert page['tabs'] == ['3 Min']
+    assert set(sheets) == {'Option', '3 Min', '5 Min', '15 Min'}
@@ -0,0 +1,36 @@
+import database_trial_main as scraper
+
+
+class RedrawingDriver:
+    """Returns the given table signatures one poll after another, then keeps returning the last one."""
+
+    def __init__(self, signatures):
+        self.signatures = list(signatures)
+        self.polls = 0
+
+    def execute_script(self, script, table_index):
+        self.polls += 1
+        return self.signatures.pop(0) if len(self.signatures) > 1 else self.signatures[0]
+
+
+def test_waits_for_a_settled_table_with_data(monkeypatch):
+    monkeypatch.setattr(scraper, 'TABLE_CHANGE_POLL', 0.001)
+    filling = '3|Time Price\n09:15'
+    redrawn = '5|Time Price\n09:15\n09:18'
+    driver = RedrawingDriver([None, '', filling, redrawn, redrawn])  # Gone, loading, filling in, then settled
+    scraper.wait_for_table_change(driver, 1, '4|Time Price\n09:12', timeout=1)
+    assert driver.polls == 5
+
+
+def test_empty_table_never_counts_as_changed(monkeypatch):
+    monkeypatch.setattr(scraper, 'TABLE_CHANGE_POLL', 0.001)
+    driver = RedrawingDriver([''])
+    waited = scraper.wait_for_table_change(driver, 1, '4|Time Price\n09:12', timeout=0.05)
+    assert waited >= 0.05
+
+
+def test_unchanged_table_is_not_taken_for_the_new_one(monkeypatch):
+    monkeypatch.setattr(scraper, 'TABLE_CHANGE_POLL', 0.001)
+    driver = RedrawingDriver(['4|Time Price\n09:12'])
+    waited = scraper.wait_for_table_change(driver, 1, '4|Time Price\n09:12', timeout=0.05)
+    assert waited >= 0.05
@@ -0,0 +1,84 @@
+from datetime import datetime
+
+import pandas as pd
+
+import database_trial_main as scraper
+from tick_store import TickStore
+
+MORNING = datetime(2024, 5, 2, 9, 18)
+NOON = datetime(2024, 5, 2, 12, 0)
+NEXT_DAY = datetime(2024, 5, 3, 9, 18)
+
+
+def snapshot(price, call_oi):
+    return {'Option': pd.DataFrame({'Strike': ['', '22000'], 'Call OI': ['', str(call_oi)]}),
+            '3 Min': pd.DataFrame({'Time': ['', '0915'], 'Price': ['', str(price)], 'Signal': ['', 'BUY']})}
+
+
+def store_with(tmp_path, *snapshots):
+    """A TickStore holding (instrument, sheets, timestamp) snapshots, all written out."""
+    store = TickStore(str(tmp_path / 'ticks'))
+    for instrument, sheets, timestamp in snapshots:
+        store.append(instrument, sheets, timestamp)
+    store.close()
+    return TickStore(str(tmp_path / 'ticks'))
+
+
+def test_appended_rows_are_partitioned_and_typed(tmp_path):
+    store = store_with(tmp_path, ('NIFTY', snapshot(22410.5, 100), MORNING),
+                       ('BANKNIFTY', snapshot(48000, 7), MORNING))
+    try:
+        assert (tmp_path / 'ticks' / 'instrument=NIFTY' / 'interval=3 Min' / 'date=2024-05-02').is_dir()
+        rows = store.query('NIFTY', interval='3 Min')
+        assert rows['row'].tolist() == [0, 1]
+        assert rows['Price'].tolist()[1] == 22410.5  # Numeric text comes back as a number, blanks as nulls
+        assert pd.isna(rows['Price'].tolist()[0])
+        assert rows['Signal'].tolist() == [None, 'BUY']
+        assert set(store.query('BANKNIFTY')['instrument']) == {'BANKNIFTY'}
+        assert store.query('FINNIFTY').empty
+    finally:
+        store.close()
+
+
+def test_query_by_time_range(tmp_path):
+    store = store_with(tmp_path, ('NIFTY', snapshot(1, 1), MORNING), ('NIFTY', snapshot(2, 2), NOON),
+                       ('NIFTY', snapshot(3, 3), NEXT_DAY))
+    try:
+        assert len(store.query('NIFTY')) == 12
+        prices = store.query('NIFTY', start=NOON, end=NEXT_DAY, interval='3 Min')['Price'].dropna().tolist()
+        assert prices == [2.0, 3.0]
+        assert store.query('NIFTY', end=MORNING, interval='3 Min')['Price'].dropna().tolist() == [1.0]
+        assert store.query('NIFTY', start=datetime(2024, 5, 4)).empty
+    finally:
+        store.close()
+
+
+def test_snapshots_rebuild_the_scraped_tables(tmp_path):
+    store = store_with(tmp_path, ('NIFTY', snapshot(1, 10), MORNING), ('NIFTY', snapshot(2, 20), NOON))
+    try:
+        snapshots = list(store.snapshots('NIFTY'))
+        assert [timestamp for timestamp, _ in snapshots] == [MORNING, NOON]
+        sheets = snapshots[1][1]
+        assert set(sheets) == {'Option', '3 Min'}
+        assert list(sheets['3 Min'].columns) == ['Time', 'Price', 'Signal']
+        assert sheets['Option']['Call OI'].tolist()[1] == 20.0
+    finally:
+        store.close()
+
+
+def test_ticks_are_keyed_by_instrument_not_file_name(tmp_path, monkeypatch):
+    url = scraper.URLS[0]
+    monkeypatch.setattr(scraper, 'INPUT_DIR', str(tmp_path))
+    (tmp_path / f"{scraper.sanitize_filename(url, str(tmp_path))}.xlsx").write_bytes(b'')  # A workbook still waiting
+    assert scraper.sanitize_filename(url, str(tmp_path)) == 'NIFTY _2'
+
+    store = TickStore(str(tmp_path / 'ticks'))
+    monkeypatch.setattr(scraper, 'tick_store', store)
+    scraper.record_ticks(url, snapshot(1, 1))
+    store.close()
+    store = TickStore(str(tmp_path / 'ticks'))
+    try:
+        assert not store.query('NIFTY').empty
+    finally:
+        store.close()
+    assert [path.name for path in (tmp_path / 'ticks').iterdir()] == ['instrument=NIFTY']
@@ -0,0 +1,69 @@
+from datetime import datetime
+
+import numpy as np
+import openpyxl
+import pandas as pd
+import pytest
+
+import excel_image_main as renderer
+
+# Time column values as scraped or read back from the workbook, grouped by the form they take
+HHMM = [915, 1512, 1200, 0, 2359, '1512', ' 0930 ', '0915', np.int64(1330)]
+BARE_HOURS = [9, 15, 12, 0, '09', '15']
+CLOCK_TEXT = ['09:15:00', '15:12:30', ' 9:05:00 ', '00:00:00', '24:00:00']
+FLOATS = [915.0, 1512.0, 1559.7, 9.99, 15.0, np.float64(1330.0)]
+BLANKS = [None, np.nan, '', ' ']
+TEXT = ['abc', '09:15 AM', '9:15', 'Time', '-', '12345', -5, '+15']
+
+
+def scalar_reference(value):
+    """What the per-cell path produced: format_time, plus HH:MM:SS text to HH:MM AM/PM (convert_to_time_format)."""
+    if isinstance(value, str):
+        try:
+            return datetime.strptime(value.strip(), '%H:%M:%S').strftime('%I:%M %p')
+        except ValueError:
+            pass
+    return renderer.format_time(value)
+
+
+def same(actual, expected):
+    return (pd.isna(actual) and pd.isna(expected)) if not isinstance(expected, str) else actual == expected
+
+
+@pytest.mark.parametrize('values', [HHMM, BARE_HOURS, CLOCK_TEXT, FLOATS, BLANKS, TEXT,
+                                    HHMM + BARE_HOURS + CLOCK_TEXT + FLOATS + BLANKS + TEXT],
+                         ids=['hhmm', 'bare hours', 'hh:mm:ss', 'floats', 'blanks', 'text', 'mixed'])
+def test_column_matches_the_scalar_path(values):
+    formatted = renderer.format_time_column(pd.Series(values, dtype=object)).tolist()
+    expected = [scalar_reference(value) for value in values]
+    assert [same(actual, wanted) for actual, wanted in zip(formatted, expected)] == [True] * len(values), \
+        list(zip(values, formatted, expected))
+
+
+def test_numeric_column_matches_the_scalar_path():
+    values = pd.Series([np.nan, 915.0, 1512.0, 15.0, 930.5])  # A float column, as read_excel gives numbers and blanks
+    formatted = renderer.format_time_column(values).tolist()
+    assert pd.isna(formatted[0])
+    assert formatted[1:] == [renderer.format_time(value) for value in values[1:]] == ['915', '03:12 PM', '03:00 PM',
+                                                                                     '930']
+
+
+@pytest.mark.parametrize('second_row_time', ['15:12:30', 1512, '1512'])
+def test_head_gate_agrees_with_the_full_gate(tmp_path, second_row_time):
+    path = str(tmp_path / 'NIFTY _1.xlsx')
+    workbook = openpyxl.Workbook()
+    workbook.active.title = 'Option'
+    workbook.active.append(['Strike', 'Call OI'])
+    workbook.active.append([22400, 1500])
+    for title in ('3 Min', '5 Min', '15 Min'):
+        worksheet = workbook.create_sheet(title)
+        worksheet.append(['Time', 'Price'])
+        worksheet.append([None, None])  # The header <tr> row the scraper keeps
+        worksheet.append([second_row_time, 22440.1])
+    workbook.save(path)
+
+    df = renderer.read_workbook(path)
+    _, position = renderer.time_gate(df, renderer.format_time_columns(df), '03:12 PM')
+    assert position == 0
+    assert renderer.load_workbook_head(path, current_time='03:12 PM') != {}
+    assert renderer.load_workbook_head(path, current_time='03:15 PM') == {}
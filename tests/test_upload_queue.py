@@ -0,0 +1,111 @@
+import asyncio
+import importlib
+
+import pytest
+from telegram.ext import ApplicationBuilder
+
+from fake_bot_api import FakeBotApi
+
+poster = importlib.import_module('best_photo_posting-qulity')
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(poster, 'BACKOFF_BASE', 0.05)
+
+
+def upload(tmp_path, images, prepare=lambda api: None, batch_window=0.0, concurrency=1):
+    """Post [(name, bytes)] through an UploadQueue talking to a fake Bot API; returns (api, uploads)."""
+    async def run():
+        api = FakeBotApi()
+        prepare(api)
+        base_url = await api.start()
+        application = ApplicationBuilder().token('123:fake').base_url(base_url).build()
+        journal = poster.UploadJournal(str(tmp_path / 'journal.sqlite3'))
+        uploads = poster.UploadQueue(application.bot, journal, concurrency=concurrency, batch_window=batch_window)
+        uploads.start()
+        try:
+            for name, data in images:
+                uploads.put(name, data)
+            await uploads.drain()
+        finally:
+            await application.shutdown()
+            journal.close()
+            await api.stop()
+        return api, uploads
+
+    return asyncio.run(run())
+
+
+def test_retry_after_is_waited_out(tmp_path):
+    api, uploads = upload(tmp_path, [('NIFTY _1.jpg', b'nifty')],
+                          lambda api: api.retry_after('sendDocument', 1))
+    assert api.methods() == ['sendDocument', 'sendDocument']
+    assert api.calls[1][1] - api.calls[0][1] >= 1.0
+    assert (uploads.uploaded, uploads.failed, uploads.requests) == (1, 0, 2)
+
+
+def test_server_errors_are_retried_with_backoff(tmp_path):
+    def prepare(api):
+        for _ in range(2):
+            api.fail('sendDocument', 500, 'Internal Server Error')
+
+    api, uploads = upload(tmp_path, [('NIFTY _1.jpg', b'nifty')], prepare)
+    assert api.methods() == ['sendDocument'] * 3
+    first_wait, second_wait = (api.calls[i + 1][1] - api.calls[i][1] for i in range(2))
+    assert first_wait >= 0.5 * poster.BACKOFF_BASE and second_wait >= poster.BACKOFF_BASE  # Doubled, jitter included
+    assert (uploads.uploaded, uploads.failed) == (1, 0)
+
+
+def test_gives_up_after_the_last_retry(tmp_path):
+    def prepare(api):
+        for _ in range(poster.UPLOAD_RETRIES + 1):
+            api.fail('sendDocument', 500, 'Internal Server Error')
+
+    api, uploads = upload(tmp_path, [('NIFTY _1.jpg', b'nifty')], prepare)
+    assert len(api.calls) == poster.UPLOAD_RETRIES + 1
+    assert (uploads.uploaded, uploads.failed) == (0, 1)
+
+
+def test_bad_request_is_not_retried(tmp_path):
+    api, uploads = upload(tmp_path, [('NIFTY _1.jpg', b'nifty')],
+                          lambda api: api.fail('sendDocument', 400, 'Bad Request: chat not found'))
+    assert api.methods() == ['sendDocument']
+    assert uploads.failed == 1
+
+
+def test_one_cycle_goes_out_as_one_media_group(tmp_path):
+    images = [('NIFTY _1.jpg', b'nifty'), ('BANKNIFTY _1.jpg', b'banknifty'), ('FINNIFTY _1.jpg', b'nifty')]
+    api, uploads = upload(tmp_path, images, batch_window=0.5)
+    assert api.methods() == ['sendMediaGroup']
+    assert sorted(api.calls[0][2]) == ['BANKNIFTY _1.jpg', 'NIFTY _1.jpg']  # The repeated content is left out
+    assert (uploads.uploaded, uploads.skipped) == (2, 1)
+
+
+def test_rate_limited_media_group_is_retried_whole(tmp_path):
+    images = [('NIFTY _1.jpg', b'nifty'), ('BANKNIFTY _1.jpg', b'banknifty')]
+    api, uploads = upload(tmp_path, images, lambda api: api.retry_after('sendMediaGroup', 1), batch_window=0.5)
+    assert api.methods() == ['sendMediaGroup', 'sendMediaGroup']
+    assert uploads.uploaded == 2
+
+
+def test_concurrent_copies_are_posted_once(tmp_path):
+    def prepare(api):
+        api.delay = 0.3  # The first upload is still in flight when the second worker checks the journal
+
+    images = [('NIFTY _1.jpg', b'nifty'), ('NIFTY _2.jpg', b'nifty')]
+    api, uploads = upload(tmp_path, images, prepare, concurrency=2)
+    assert api.methods() == ['sendDocument']
+    assert (uploads.uploaded, uploads.skipped) == (1, 1)
+
+
+def test_failed_post_frees_the_content(tmp_path):
+    images = [('NIFTY _1.jpg', b'nifty'), ('NIFTY _2.jpg', b'nifty')]
+    api, uploads = upload(tmp_path, images, lambda api: api.fail('sendDocument', 400, 'Bad Request: chat not found'))
+    assert api.methods() == ['sendDocument', 'sendDocument']
+    assert (uploads.uploaded, uploads.failed, uploads.skipped) == (1, 1, 0)
+    journal = poster.UploadJournal(str(tmp_path / 'journal.sqlite3'))
+    try:
+        assert len(journal.hashes) == 1 and not journal.reserved
+    finally:
+        journal.close()
@@ -0,0 +1,46 @@
+import os
+import time
+
+import excel_image_main as renderer
+
+
+def write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def settle(intake):
+    """Run the two size/mtime checks a finished file needs."""
+    intake.ready_files()
+    return intake.ready_files()
+
+
+def test_newer_version_waits_for_the_render_in_flight(tmp_path):
+    path = str(tmp_path / 'NIFTY _1.xlsx')
+    write(path, 'version 1')
+    intake = renderer.WorkbookIntake()
+    intake.add(path)
+    [(ready_path, signature)] = settle(intake)
+    intake.start(ready_path)
+
+    time.sleep(0.01)
+    write(path, 'version 2, written during the render')
+    intake.add(path)
+    assert settle(intake) == []  # Held back, not dropped
+    assert not intake.has_pending()
+
+    renderer.remove_workbook(path, signature)  # The worker finishing version 1
+    assert os.path.exists(path)
+    intake.finish(path)
+    assert intake.has_pending()
+    [(_, newer)] = settle(intake)
+    assert newer != signature
+
+
+def test_unchanged_workbook_is_removed(tmp_path):
+    path = str(tmp_path / 'NIFTY _1.xlsx')
+    write(path, 'version 1')
+    stat = os.stat(path)
+    renderer.remove_workbook(path, (stat.st_size, stat.st_mtime_ns))
+    assert not os.path.exists(path)
+    renderer.remove_workbook(path)  # Already gone
@@ -0,0 +1,186 @@
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Append-only history of every scraped snapshot, as Parquet files partitioned by instrument, interval and day:
+#   TICK_STORE_DIR/instrument=NIFTY/interval=3 Min/date=2024-05-02/<first>_<last>.parquet
+# Each row is one table row of one snapshot: timestamp, instrument, interval, row, then the table's own columns.
+TICK_STORE_DIR = 'ticks/'
+FLUSH_INTERVAL = 300  # Seconds a partition buffers snapshots before they are written out as one file
+WRITER_QUEUE_SIZE = 100  # Snapshots waiting for the writer thread; beyond this new ones are dropped, never waited on
+FILE_TIME_FORMAT = '%Y%m%dT%H%M%S%f'
+
+
+def typed_frame(data_frame):
+    """
+    Columns with unique text names, numeric text as numbers and blanks as nulls. Columns that are not all
+    numeric stay text, so every file has one plain type per column.
+    """
+    data_frame = data_frame.replace('', None).copy()
+    names, seen = [], {}
+    for column in map(str, data_frame.columns):
+        name = column
+        while name in seen:
+            seen[column] += 1
+            name = f"{column}.{seen[column]}"
+        seen[name] = 0
+        names.append(name)
+    data_frame.columns = names
+
+    for column in names:
+        values = data_frame[column]
+        numbers = pd.to_numeric(values, errors='coerce')
+        if numbers.notna().sum() == values.notna().sum():
+            data_frame[column] = numbers.astype('float64')
+        else:
+            data_frame[column] = values.map(lambda value: None if pd.isna(value) else str(value)).astype(object)
+    return data_frame
+
+
+class TickStore:
+    """
+    Writes snapshots on a background thread so the scrape loop never waits on disk, and answers range queries
+    by instrument, interval and time from the partition layout.
+    """
+
+    def __init__(self, root=TICK_STORE_DIR, flush_interval=FLUSH_INTERVAL):
+        self.root = root
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=WRITER_QUEUE_SIZE)
+        self.buffers = {}  # (instrument, interval, date) -> (first buffered at, [frames])
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.run, name='tick-store-writer', daemon=True)
+        self.thread.start()
+
+    def append(self, instrument, sheets, timestamp=None):
+        """Queue one snapshot: sheets maps an interval label ("Option", "3 Min", ...) to its DataFrame."""
+        try:
+            self.queue.put_nowait((instrument, sheets, timestamp or datetime.now()))
+        except queue.Full:
+            self.dropped += 1
+            print(f"Tick store is behind; dropped the {instrument} snapshot ({self.dropped} so far)")
+
+    def close(self):
+        """Write everything still buffered and stop the writer thread."""
+        self.queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=1)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                self.flush(force=True)
+                return
+            if item:
+                try:
+                    self.buffer(*item)
+                except Exception as e:
+                    print(f"Tick store could not record a snapshot: {e}")
+            self.flush()
+
+    def buffer(self, instrument, sheets, timestamp):
+        for interval, data_frame in sheets.items():
+            if data_frame is None or data_frame.empty:
+                continue
+            rows = typed_frame(data_frame)
+            rows.insert(0, 'row', range(len(rows)))
+            rows.insert(0, 'interval', interval)
+            rows.insert(0, 'instrument', instrument)
+            rows.insert(0, 'timestamp', pd.Timestamp(timestamp))
+            key = (instrument, interval, timestamp.date())
+            self.buffers.setdefault(key, (time.monotonic(), []))[1].append(rows)
+
+    def flush(self, force=False):
+        for key in list(self.buffers):
+            buffered_at, frames = self.buffers[key]
+            if force or time.monotonic() - buffered_at >= self.flush_interval:
+                del self.buffers[key]
+                try:
+                    self.write_partition(key, frames)
+                except Exception as e:
+                    print(f"Tick store could not write {key}: {e}")
+
+    def partition_dir(self, instrument, interval, date):
+        return os.path.join(self.root, f"instrument={instrument.strip()}", f"interval={interval}", f"date={date}")
+
+    def write_partition(self, key, frames):
+        # Snapshots of one partition can differ in columns; each file keeps its own schema
+        for part, group in enumerate(self.group_by_columns(frames)):
+            table = pa.Table.from_pandas(pd.concat(group, ignore_index=True), preserve_index=False)
+            directory = self.partition_dir(*key)
+            os.makedirs(directory, exist_ok=True)
+            first, last = group[0]['timestamp'].iloc[0], group[-1]['timestamp'].iloc[0]
+            name = f"{first.strftime(FILE_TIME_FORMAT)}_{last.strftime(FILE_TIME_FORMAT)}"
+            temp_path = os.path.join(directory, f".{name}.tmp")
+            pq.write_table(table, temp_path)
+            os.replace(temp_path, os.path.join(directory, f"{name}_{part}.parquet"))
+
+    @staticmethod
+    def group_by_columns(frames):
+        groups = {}
+        for rows in frames:
+            groups.setdefault(tuple(rows.columns), []).append(rows)
+        return groups.values()
+
+    def query(self, instrument, start=None, end=None, interval=None):
+        """
+        Rows of instrument between start and end (datetimes, inclusive), optionally for one interval, sorted by
+        time. Only the day partitions and files whose time span overlaps the range are opened.
+        """
+        filters = []
+        if start is not None:
+            filters.append(('timestamp', '>=', pd.Timestamp(start)))
+        if end is not None:
+            filters.append(('timestamp', '<=', pd.Timestamp(end)))
+        start = start or datetime.min
+        end = end or datetime.max
+        instrument_dir = os.path.join(self.root, f"instrument={instrument.strip()}")
+        if not os.path.isdir(instrument_dir):
+            return pd.DataFrame()
+
+        frames = []
+        intervals = [f"interval={interval}"] if interval else sorted(os.listdir(instrument_dir))
+        for interval_name in intervals:
+            interval_dir = os.path.join(instrument_dir, interval_name)
+            if not os.path.isdir(interval_dir):
+                continue
+            for date_name in sorted(os.listdir(interval_dir)):
+                date = datetime.strptime(date_name[len('date='):], '%Y-%m-%d')
+                if date + timedelta(days=1) <= start or date > end:
+                    continue
+                date_dir = os.path.join(interval_dir, date_name)
+                for file_name in sorted(os.listdir(date_dir)):
+                    if not file_name.endswith('.parquet'):
+                        continue
+                    first, last = (datetime.strptime(part, FILE_TIME_FORMAT) for part in file_name.split('_')[:2])
+                    if last < start or first > end:
+                        continue
+                    table = pq.read_table(os.path.join(date_dir, file_name), filters=filters or None)
+                    frames.append(table.to_pandas())
+
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True).sort_values(['timestamp', 'interval', 'row'], ignore_index=True)
+
+    def snapshots(self, instrument, start=None, end=None):
+        """
+        Rebuild scraped snapshots from the store: yields (timestamp, sheets) with sheets mapping each interval to
+        its table, as scrape_instrument returned them but with typed values. Columns that are empty throughout a
+        snapshot are left out.
+        """
+        rows = self.query(instrument, start, end)
+        for timestamp, snapshot in rows.groupby('timestamp', sort=True):
+            sheets = {}
+            for interval, table in snapshot.groupby('interval', sort=False):
+                table = table.drop(columns=['timestamp', 'instrument', 'interval', 'row']).dropna(axis=1, how='all')
+                sheets[interval] = table.reset_index(drop=True)
+            yield timestamp.to_pydatetime(), sheets